@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import fnmatch
+import hashlib
+import io
+import json
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+
+from config import IMAGES_DIR, IMAGES_PATTERN, CATALOG_POLL_INTERVAL, INGEST_DIR
+
+logger = logging.getLogger('tuboton')
+
+# === VIGILANCIA DE LA CARPETA CON INOTIFY ===
+# Llamadas directas a la libc con ctypes: no hace falta ninguna dependencia
+# y fuera de Linux simplemente no está disponible.
+
+IN_CLOSE_WRITE = 0x0008   # Fichero escrito y cerrado
+IN_MOVED_FROM = 0x0040    # Fichero movido fuera de la carpeta
+IN_MOVED_TO = 0x0080      # Fichero movido a la carpeta
+IN_DELETE = 0x0200        # Fichero borrado
+IN_DELETE_SELF = 0x0400   # La propia carpeta se borró
+IN_MOVE_SELF = 0x0800     # La propia carpeta se movió
+IN_Q_OVERFLOW = 0x4000    # Se perdieron eventos
+IN_IGNORED = 0x8000       # La vigilancia terminó
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+WATCH_LOST = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+# struct inotify_event: wd, mask, cookie, len y después el nombre
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+def inotify_open(directory):
+    """Descriptor inotify que vigila directory, o None si el sistema no lo ofrece"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+def read_inotify_events(fd):
+    """Lee los eventos pendientes como pares (máscara, nombre del fichero)"""
+    data = os.read(fd, 64 * 1024)
+    offset = 0
+    while offset < len(data):
+        _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+        offset += _INOTIFY_EVENT.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        yield mask, os.fsdecode(name)
+
+# === CATÁLOGO DE IMÁGENES ===
+
+CatalogImage = namedtuple('CatalogImage', ['path', 'width', 'height', 'format', 'digest', 'mtime'])
+
+def describe_image(image_path):
+    """Dimensiones y formato (de la cabecera) y hash del contenido de una imagen"""
+    mtime = os.stat(image_path).st_mtime_ns
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        image_format = img.format
+    return CatalogImage(image_path, width, height, image_format, hashlib.sha1(data).hexdigest(), mtime)
+
+# === INGESTA: CADA IMAGEN SE DECODIFICA UNA SOLA VEZ ===
+
+# Extensiones esperadas para cada formato que detecta Pillow
+FORMAT_EXTENSIONS = {"JPEG": (".jpg", ".jpeg"), "PNG": (".png",), "GIF": (".gif",), "WEBP": (".webp",), "BMP": (".bmp",)}
+
+# Modos que se guardan tal cual; el resto se pasa a RGB (o RGBA si tiene transparencia)
+RAW_MODES = ("L", "RGB", "RGBA")
+
+class ImageStore:
+    """Imágenes de la biblioteca ya decodificadas, con un manifiesto de lo ingerido
+
+    ingest() mira el formato real del fichero (no la extensión), lo decodifica
+    entero, así que un fichero corrupto falla ahí y no al pulsar el botón,
+    y guarda los píxeles en bruto en cache_dir con una cabecera (modo, ancho,
+    alto), indexados por hash del contenido. open() los devuelve sin
+    descomprimir nada. El manifiesto guarda el mtime de cada fuente para no
+    volver a leerla mientras no cambie.
+    """
+
+    MAGIC = b"TBI1"
+    HEADER = struct.Struct('<4s4sHH')
+
+    def __init__(self, cache_dir=INGEST_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest_path = os.path.join(cache_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+        self._dirty = False
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Escribe el manifiesto si cambió, de forma atómica"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self._manifest_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._manifest, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self._manifest_path)
+            self._dirty = False
+
+    def _raw_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.raw")
+
+    def _current(self, image_path):
+        """Entrada del manifiesto si la fuente no ha cambiado desde que se ingirió"""
+        try:
+            mtime = os.stat(image_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            entry = self._manifest.get(image_path)
+        if entry and entry["mtime"] == mtime and os.path.exists(self._raw_path(entry["digest"])):
+            return entry
+        return None
+
+    def ingest(self, image_path):
+        """Normaliza una imagen (si no lo estaba ya) y devuelve su CatalogImage
+
+        Lanza la excepción de Pillow si el fichero no es una imagen válida.
+        """
+        entry = self._current(image_path)
+        if entry is None:
+            entry = self._normalise(image_path)
+        return CatalogImage(image_path, entry["width"], entry["height"], entry["format"], entry["digest"], entry["mtime"])
+
+    def _normalise(self, image_path):
+        mtime = os.stat(image_path).st_mtime_ns
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        with Image.open(io.BytesIO(data)) as img:
+            image_format = img.format
+            img.load()
+            if img.mode not in RAW_MODES:
+                img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+            mode, size, pixels = img.mode, img.size, img.tobytes()
+
+        extension = os.path.splitext(image_path)[1].lower()
+        if extension not in FORMAT_EXTENSIONS.get(image_format, (extension,)):
+            logger.debug(f"{image_path} es en realidad {image_format}")
+
+        raw_path = self._raw_path(digest)
+        tmp_path = f"{raw_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, mode.encode(), size[0], size[1]))
+            f.write(pixels)
+        os.replace(tmp_path, raw_path)
+
+        entry = {"digest": digest, "mtime": mtime, "format": image_format, "mode": mode, "width": size[0], "height": size[1]}
+        with self._lock:
+            self._manifest[image_path] = entry
+            self._dirty = True
+        return entry
+
+    def open(self, image_path):
+        """Imagen ya decodificada si está ingerida y al día; si no, se abre el fichero original"""
+        entry = self._current(image_path)
+        if entry is not None:
+            try:
+                with open(self._raw_path(entry["digest"]), 'rb') as f:
+                    data = f.read()
+                magic, mode, width, height = self.HEADER.unpack_from(data)
+                mode = mode.rstrip(b'\0').decode()
+                pixels = data[self.HEADER.size:]
+                if magic == self.MAGIC and len(pixels) == width * height * len(mode):
+                    return Image.frombuffer(mode, (width, height), pixels, 'raw', mode, 0, 1)
+            except (OSError, struct.error, ValueError):
+                pass
+            logger.warning(f"Imagen ingerida corrupta para {image_path}, se usa el original")
+        return Image.open(image_path)
+
+    def forget(self, image_path):
+        """Quita una fuente del manifiesto y sus píxeles si ninguna otra los usa"""
+        with self._lock:
+            entry = self._manifest.pop(image_path, None)
+            if entry is None:
+                return
+            self._dirty = True
+            shared = any(other["digest"] == entry["digest"] for other in self._manifest.values())
+        if not shared:
+            try:
+                os.remove(self._raw_path(entry["digest"]))
+            except FileNotFoundError:
+                pass
+
+    def prune(self, keep):
+        """Olvida las fuentes que ya no están en keep y borra los píxeles huérfanos"""
+        with self._lock:
+            stale = [image_path for image_path in self._manifest if image_path not in keep]
+        for image_path in stale:
+            self.forget(image_path)
+        with self._lock:
+            digests = {entry["digest"] for entry in self._manifest.values()}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".raw") and name[:-len(".raw")] not in digests:
+                os.remove(os.path.join(self.cache_dir, name))
+
+class ImageCatalog:
+    """Imágenes de la biblioteca en memoria, al día con lo que hay en la carpeta
+
+    Se construye una vez (refresh) y después watch() lo mantiene con inotify:
+    solo se leen los ficheros que se añaden, cambian o desaparecen. Sin
+    inotify, la carpeta se revisa cada CATALOG_POLL_INTERVAL segundos
+    comparando mtimes. Elegir una imagen al azar es O(1).
+
+    Con un ImageStore, cada imagen se ingiere (y se valida) al entrar en el
+    catálogo y una que no se puede decodificar se queda fuera. Las superficies
+    y rasters derivados viven en sus propias cachés; quien se suscribe
+    (subscribe) recibe ("added", entrada) o ("removed", entrada) para
+    prepararlos o descartarlos.
+    """
+
+    def __init__(self, directory=IMAGES_DIR, pattern=IMAGES_PATTERN, store=None):
+        self.directory = directory
+        self.pattern = pattern
+        self.store = store
+        self._entries = {}
+        self._paths = []   # Las mismas rutas en una lista, para elegir al azar
+        self._index = {}   # Ruta -> posición en _paths
+        self._rejected = {}  # Ruta -> mtime de los ficheros que no se pudieron leer
+        self._listeners = []
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._paths)
+
+    def __contains__(self, image_path):
+        return image_path in self._entries
+
+    def get(self, image_path):
+        """Entrada del catálogo de una ruta, o None"""
+        return self._entries.get(image_path)
+
+    def paths(self):
+        """Rutas de todas las imágenes del catálogo"""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._paths)
+
+    def subscribe(self, callback):
+        """callback(evento, entrada) para cada imagen que entra ('added') o sale ('removed')"""
+        self._listeners.append(callback)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.refresh()
+
+    def _matches(self, name):
+        return fnmatch.fnmatch(name, self.pattern)
+
+    def has_files(self):
+        """True si la carpeta tiene algún fichero que encaje con el patrón, sin leer ninguno"""
+        try:
+            with os.scandir(self.directory) as it:
+                return any(self._matches(item.name) and item.is_file() for item in it)
+        except FileNotFoundError:
+            return False
+
+    def refresh(self):
+        """Compara el catálogo con la carpeta y actualiza solo lo que cambió"""
+        found = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if self._matches(item.name) and item.is_file():
+                        found[os.path.join(self.directory, item.name)] = item.stat().st_mtime_ns
+        except FileNotFoundError:
+            logger.error(f"Directorio '{self.directory}' no encontrado")
+
+        for image_path in [path for path in self._entries if path not in found]:
+            self._remove(image_path)
+        for image_path, mtime in found.items():
+            entry = self._entries.get(image_path)
+            # Un fichero que ya falló no se reintenta hasta que cambie
+            if self._rejected.get(image_path) == mtime:
+                continue
+            if entry is None or entry.mtime != mtime:
+                self._update(image_path)
+        if self.store is not None:
+            self.store.prune(found)
+            self.store.save()
+        self._loaded = True
+
+    def _update(self, image_path):
+        """Vuelve a leer una imagen nueva o cambiada; si ya no se puede leer, sale del catálogo"""
+        try:
+            entry = self.store.ingest(image_path) if self.store is not None else describe_image(image_path)
+        except FileNotFoundError:
+            self._remove(image_path)
+            return
+        except Exception as e:
+            logger.warning(f"Imagen ignorada en la biblioteca {image_path}: {str(e)}")
+            try:
+                self._rejected[image_path] = os.stat(image_path).st_mtime_ns
+            except OSError:
+                pass
+            self._remove(image_path)
+            return
+        self._rejected.pop(image_path, None)
+        # Si cambió, lo derivado de la versión anterior ya no vale
+        self._drop(image_path)
+        with self._lock:
+            self._entries[image_path] = entry
+            self._index[image_path] = len(self._paths)
+            self._paths.append(image_path)
+        self._notify("added", entry)
+
+    def _remove(self, image_path):
+        self._drop(image_path)
+        if self.store is not None:
+            self.store.forget(image_path)
+
+    def _drop(self, image_path):
+        with self._lock:
+            entry = self._entries.pop(image_path, None)
+            if entry is None:
+                return
+            # La última ruta ocupa el hueco: quitar también es O(1)
+            position = self._index.pop(image_path)
+            last = self._paths.pop()
+            if last != image_path:
+                self._paths[position] = last
+                self._index[last] = position
+        self._notify("removed", entry)
+
+    def _notify(self, event, entry):
+        # Lo que cambia con el kiosko en marcha queda en el log
+        if self._thread is not None:
+            if event == "added":
+                logger.info(f"Biblioteca: nueva imagen {entry.path} ({entry.width}x{entry.height} {entry.format})")
+            else:
+                logger.info(f"Biblioteca: imagen retirada {entry.path}")
+        for callback in self._listeners:
+            try:
+                callback(event, entry)
+            except Exception as e:
+                logger.error(f"Biblioteca: error al procesar {entry.path}: {str(e)}")
+
+    def watch(self, poll_interval=CATALOG_POLL_INTERVAL):
+        """Mantiene el catálogo al día en segundo plano"""
+        # La vigilancia empieza antes de leer la carpeta para no perder nada entre medias
+        fd = inotify_open(self.directory)
+        self.refresh()
+        self._thread = threading.Thread(target=self._watch, args=(fd, poll_interval), name="biblioteca", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self, fd, poll_interval):
+        if fd is not None:
+            try:
+                self._watch_inotify(fd)
+            finally:
+                os.close(fd)
+        if not self._stop.is_set():
+            logger.info(f"Biblioteca: revisando '{self.directory}' cada {poll_interval}s (sin inotify)")
+        while not self._stop.wait(poll_interval):
+            self.refresh()
+
+    def _watch_inotify(self, fd):
+        # Solo vuelve si se para el catálogo o se pierde la carpeta vigilada
+        while not self._stop.is_set():
+            ready, _, _ = select.select([fd], [], [], 1.0)
+            if not ready:
+                continue
+            for mask, name in read_inotify_events(fd):
+                if mask & WATCH_LOST:
+                    return
+                if mask & IN_Q_OVERFLOW:
+                    self.refresh()
+                elif self._matches(name):
+                    image_path = os.path.join(self.directory, name)
+                    if mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._remove(image_path)
+                    else:
+                        self._update(image_path)
+            if self.store is not None:
+                self.store.save()
+
+def _warm_image(image_path, screen_size, surface_cache, raster_cache):
+    """Prepara la superficie de pantalla y, si procede, el raster de impresión"""
+    surface_cache.get(image_path, screen_size)
+    if raster_cache is not None:
+        raster_cache.get(image_path)
+
+def prewarm_library(image_paths, screen_size, surface_cache, raster_cache=None, display_only=(), workers=2, pack=True):
+    """Decodifica, escala y rasteriza todas las imágenes en un pool de hilos
+
+    Las rutas de display_only (p. ej. la suscripción) solo se preparan para pantalla.
+    pack=False para precargar solo unas pocas sin rehacer el fichero de fotogramas,
+    que debe contener la biblioteca entera.
+    """
+    total = len(image_paths) + len(display_only)
+    start = time.time()
+    done = 0
+    failed = 0
+    logger.info(f"Precargando {total} imágenes con {workers} hilos...")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precarga") as executor:
+        # Las imágenes se empaquetan primero en el fichero de fotogramas, también
+        # las de solo pantalla: la suscripción queda escalada de un arranque a otro
+        if pack:
+            surface_cache.pack(list(image_paths) + list(display_only), screen_size, executor.map)
+
+        futures = {
+            executor.submit(_warm_image, path, screen_size, surface_cache, raster_cache): path
+            for path in image_paths
+        }
+        for path in display_only:
+            futures[executor.submit(_warm_image, path, screen_size, surface_cache, None)] = path
+        for future in as_completed(futures):
+            done += 1
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error al precargar {futures[future]}: {str(e)}")
+            if done % 20 == 0 or done == total:
+                logger.info(f"Precarga: {done}/{total} imágenes")
+
+    elapsed = time.time() - start
+    logger.info(f"✓ Precarga completada en {elapsed:.1f}s ({failed} errores)")
+    return failed
+
+def start_prewarm(image_paths, screen_size, surface_cache, raster_cache=None, display_only=(), workers=2):
+    """Lanza la precarga en segundo plano para no retrasar el arranque"""
+    thread = threading.Thread(
+        target=prewarm_library,
+        args=(image_paths, screen_size, surface_cache, raster_cache, display_only, workers),
+        name="precarga",
+        daemon=True,
+    )
+    thread.start()
+    return thread
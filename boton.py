@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import logging
+import queue
+import time
+from collections import namedtuple
+
+import pygame
+
+logger = logging.getLogger('tuboton')
+
+# Evento de Pygame que despierta al bucle principal cuando se pulsa el botón
+BUTTON_EVENT = pygame.USEREVENT + 1
+
+ButtonPress = namedtuple('ButtonPress', ['seq', 'pressed_at'])
+
+class ButtonEvents:
+    """Pulsaciones del botón físico recogidas por interrupción
+
+    gpiozero llama a when_pressed desde su propio hilo en cada flanco (ya
+    filtrado por bounce_time); la pulsación se guarda con la marca de tiempo
+    del flanco en una cola segura entre hilos y se despierta al bucle
+    principal con BUTTON_EVENT. Mantener el botón pulsado cuenta una sola vez.
+    """
+
+    def __init__(self, button):
+        self.button = button
+        self._queue = queue.Queue()
+        self._seq = 0
+        self.presses = 0
+        self.handled = 0
+        self.queued = 0
+        self.ignored = 0
+        self._latencies = []
+        button.when_pressed = self._on_pressed
+
+    def _on_pressed(self):
+        pressed_at = time.time()
+        self._seq += 1
+        self._queue.put(ButtonPress(self._seq, pressed_at))
+        try:
+            pygame.event.post(pygame.event.Event(BUTTON_EVENT))
+        except pygame.error:
+            # Sin pantalla todavía: la pulsación queda en la cola igualmente
+            pass
+
+    def drain(self):
+        """Devuelve las pulsaciones pendientes, en orden"""
+        presses = []
+        while True:
+            try:
+                presses.append(self._queue.get_nowait())
+            except queue.Empty:
+                return presses
+
+    def record(self, press, outcome, dequeued=False):
+        """Registra la latencia desde el flanco hasta la reacción del bucle
+
+        outcome es el resultado de atender la pulsación: 'start', 'queued' o 'ignored'.
+        Con dequeued la pulsación ya se contó al entrar en cola y ahora se
+        atiende; su latencia incluye la espera en la cola.
+        """
+        latency = time.time() - press.pressed_at
+        if not dequeued:
+            self.presses += 1
+        if outcome == "start":
+            self.handled += 1
+            self._latencies.append(latency)
+            origin = "desde la cola, " if dequeued else ""
+            logger.info(f"Botón #{press.seq}: reacción {origin}en {latency * 1000:.1f} ms")
+        elif outcome == "queued":
+            self.queued += 1
+            logger.info(f"Botón #{press.seq}: en cola (imagen en pantalla)")
+        else:
+            # Llegó mientras se mostraba otra imagen: se descarta como antes
+            self.ignored += 1
+            logger.info(f"Botón #{press.seq}: ignorado (imagen en pantalla), {latency * 1000:.1f} ms")
+
+    def report(self):
+        """Resume pulsaciones, descartes y latencias en el log"""
+        if not self._latencies:
+            logger.info(f"Botón: {self.presses} pulsaciones, {self.queued} en cola, {self.ignored} ignoradas")
+            return
+        latencies = sorted(self._latencies)
+        mean = sum(latencies) / len(latencies)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        logger.info(
+            f"Botón: {self.presses} pulsaciones, {self.handled} atendidas, {self.queued} en cola, {self.ignored} ignoradas - "
+            f"latencia media {mean * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, máx {latencies[-1] * 1000:.1f} ms"
+        )
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import usb.core
+from escpos.exceptions import DeviceNotFoundError
+
+logger = logging.getLogger('tuboton')
+
+# === IMPRESORA SIMULADA CON CAPTURA ===
+# Sustituye a la impresora USB (PRINTER_BACKEND = "captura") para probar el
+# kiosko o hacer pruebas de carga en cualquier Linux: guarda exactamente los
+# bytes ESC/POS que recibiría la impresora y tarda lo que tardaría el USB.
+
+class CaptureBus:
+    """Conexión simulada con la impresora: ancho de banda, latencia y captura de bytes
+
+    Todo lo enviado se añade a sink: un fichero (se abre en modo añadir) o,
+    sin sink, captured en memoria. bytes_per_second=None no limita el ancho
+    de banda; latency se suma a cada transferencia. Con print_rate y
+    buffer_size también simula el buffer de recepción: se vacía a la
+    velocidad de impresión y lo que no cabe se pierde, que es lo que pasa
+    al enviar a ciegas. La impresora se puede desenchufar desde otro hilo.
+    """
+
+    def __init__(self, bytes_per_second=None, latency=0.0, print_rate=None, buffer_size=None, sink=None):
+        self.bytes_per_second = bytes_per_second
+        self.latency = latency
+        self.print_rate = print_rate
+        self.buffer_size = buffer_size
+        self.plugged = True
+        self.generation = 0
+        self.bytes_written = 0
+        self.transfers = 0
+        self.overflow = 0
+        self.level = 0
+        self.captured = bytearray() if sink is None else None
+        self._sink = open(sink, 'ab') if sink else None
+        self._level_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _drain(self):
+        now = time.perf_counter()
+        if self.print_rate:
+            self.level = max(0, self.level - (now - self._level_at) * self.print_rate)
+        self._level_at = now
+
+    def transfer(self, data):
+        """Una transferencia USB: espera lo que tardaría y guarda los bytes"""
+        delay = self.latency
+        if self.bytes_per_second:
+            delay += len(data) / self.bytes_per_second
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.transfers += 1
+            self.bytes_written += len(data)
+            if self._sink:
+                self._sink.write(data)
+            else:
+                self.captured += data
+        self._receive(len(data))
+
+    def _receive(self, size):
+        """Datos que llegan al buffer de la impresora"""
+        self._drain()
+        self.level += size
+        if self.buffer_size and self.level > self.buffer_size:
+            self.overflow += self.level - self.buffer_size
+            self.level = self.buffer_size
+
+    def drain_time(self):
+        """Segundos hasta que la impresora termine lo que tiene en el buffer"""
+        self._drain()
+        return self.level / self.print_rate if self.print_rate else 0
+
+    def unplug(self):
+        with self._lock:
+            self.plugged = False
+            self.generation += 1
+
+    def plug(self):
+        with self._lock:
+            self.plugged = True
+
+    def connect(self):
+        """Equivalente a setup_printer() para el supervisor"""
+        return CapturePrinter(self)
+
+    def flush(self):
+        """Vuelca al fichero lo capturado hasta ahora"""
+        with self._lock:
+            if self._sink:
+                self._sink.flush()
+
+    def close(self):
+        with self._lock:
+            if self._sink:
+                self._sink.close()
+                self._sink = None
+
+# Prefijo de las consultas de estado en tiempo real
+DLE_EOT = b"\x10\x04"
+
+class CapturePrinter:
+    """Imita lo que el supervisor usa de escpos.printer.Usb: device, endpoints, _raw, read y close
+
+    Como escpos.printer.File, tiene flush() para volcar cada ticket al fichero.
+
+    Cada escritura falla con el mismo USBError que pyusb si la impresora se
+    desenchufó desde que se abrió el manejador. DLE EOT es un comando en
+    tiempo real: la respuesta (siempre en línea y con papel) queda lista en
+    el endpoint de entrada al momento, aunque haya datos sin imprimir, y se
+    queda ahí hasta que alguien la lee.
+    """
+
+    out_ep = 0x01
+    in_ep = 0x81
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._generation = None
+        self._replies = deque()
+
+    @property
+    def device(self):
+        if not self.bus.plugged:
+            raise DeviceNotFoundError("Impresora simulada desenchufada")
+        if self._generation is None:
+            self._generation = self.bus.generation
+        return self
+
+    def get_active_configuration(self):
+        return {(0, 0): [SimpleNamespace(bEndpointAddress=self.out_ep, wMaxPacketSize=64)]}
+
+    def _check(self):
+        # Como escpos, el primer uso abre el dispositivo
+        self.device
+        if not self.bus.plugged or self.bus.generation != self._generation:
+            raise usb.core.USBError("No such device (it may have been disconnected)", errno=19)
+
+    def _raw(self, data):
+        self._check()
+        self.bus.transfer(data)
+        self._check()
+        if data[:2] == DLE_EOT:
+            self._replies.append(0x12)
+
+    def read(self, endpoint, size, timeout_ms):
+        self._check()
+        if not self._replies or self.bus.latency * 1000 > timeout_ms:
+            time.sleep(timeout_ms / 1000)
+            raise usb.core.USBTimeoutError("Operation timed out", errno=110)
+        time.sleep(self.bus.latency)
+        return bytes([self._replies.popleft()])
+
+    def flush(self):
+        self.bus.flush()
+
+    def close(self):
+        pass
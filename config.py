@@ -1,9 +1,68 @@
 #!/usr/bin/env python3
 
+import os
+
 # --- Configuración de la Impresora ---
 VENDOR_ID = 0x0416
 PRODUCT_ID = 0x5011
 
+# Impresora que se usa: "usb" (la térmica real) o "captura" (simulada, sin hardware:
+# guarda los bytes ESC/POS en PRINTER_CAPTURE_PATH con el ancho de banda y la
+# latencia indicados; ver captura.py)
+PRINTER_BACKEND = "usb"
+PRINTER_CAPTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "captura.bin")
+PRINTER_CAPTURE_KBPS = 100  # kB/s del USB simulado (None: sin límite)
+PRINTER_CAPTURE_LATENCY = 0.001  # Segundos que añade cada transferencia USB simulada
+
+# Paquetes USB por escritura al enviar un ticket (64 x 64 bytes = 4 KB)
+PRINTER_PACKETS_PER_WRITE = 64
+
+# Reconexión si la impresora se desenchufa o deja de responder
+PRINTER_JOB_POLICY = "replay"  # Trabajo en curso si se desconecta la impresora: "replay" o "discard"
+PRINTER_REPLAY_ATTEMPTS = 2  # Reenvíos de un mismo ticket como máximo
+PRINTER_RECONNECT_MIN = 0.5  # Espera inicial entre intentos de reconexión (segundos)
+PRINTER_RECONNECT_MAX = 10  # Espera máxima entre intentos de reconexión (segundos)
+PRINTER_RECONNECT_TIMEOUT = 30  # Tiempo que un trabajo espera a que vuelva la impresora (segundos)
+
+# Control de flujo: DLE EOT solo dice si está en línea y con papel (contesta al
+# momento, no cuando termina de imprimir), así que los bytes pendientes en el
+# buffer se estiman con la velocidad de impresión
+PRINTER_PRINT_RATE = 20000  # Bytes por segundo que imprime la impresora (None: sin límite)
+PRINTER_BUFFER_SIZE = 4096  # Bytes sin imprimir que se dejan como mucho en su buffer
+PRINTER_STATUS_WINDOW = 4096  # Bytes enviados entre consultas de que la impresora está lista
+PRINTER_STATUS_TIMEOUT = 1.0  # Espera máxima de cada respuesta de estado (segundos)
+PRINTER_STATUS_POLL = 0.2  # Intervalo de consulta mientras está fuera de línea o sin papel (segundos)
+PRINTER_STATUS_STALL = 60  # Tiempo fuera de línea antes de dar el trabajo por interrumpido (segundos)
+
+# Ancho máximo de impresión en puntos (papel de 58 mm)
+PRINTER_MAX_WIDTH = 384
+RASTER_BAND_HEIGHT = 256  # Líneas por banda al enviar imágenes con GS v 0 / GS ( L
+
+# Comando de imagen ESC/POS si no hay uno medido para esta impresora
+# (tu_boton_benchmark.py impl mide y guarda el mejor en PRINTER_PROFILES_PATH)
+DEFAULT_IMAGE_IMPL = "bitImageColumn"
+PRINTER_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "impresoras.json")
+
+# Cómo se imprime el ticket artístico:
+#   "texto":  con la fuente de la impresora, mezclando texto e imágenes
+#   "bitmap": maquetado entero como una sola imagen (incluido el QR, aunque QR_NATIVE sea True)
+TICKET_RENDER = "texto"
+TICKET_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf"  # Si no existe se usa la de Pillow
+TICKET_FONT_SIZE = 20  # 20 puntos = unas 32 columnas en papel de 58 mm
+
+# Procesado de imágenes para la impresora térmica
+THERMAL_CONTRAST = 2.5     # Aumentado de 1.5 a 2.5
+THERMAL_BRIGHTNESS = 0.8   # Valor < 1 hace la imagen más oscura
+THERMAL_THRESHOLD = 150    # Reducido de 180 a 150 para obtener más píxeles negros
+THERMAL_DITHER = "threshold"  # "threshold", "floyd-steinberg" o "bayer"
+
+# Directorio donde se guardan los rasters ya procesados entre reinicios
+RASTER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "raster")
+
+# Directorio con las imágenes de la biblioteca ya decodificadas (píxeles en bruto),
+# para no volver a descomprimir el JPEG en cada uso
+INGEST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "imagenes")
+
 # --- Configuración de Debug ---
 DEBUG_MODE = False   # Cambia a False para modo normal
 
@@ -14,13 +73,19 @@ SOLO_BOTON = False # Si es True, la impresora no se inicializa ni se usa
 SERVO_PIN = 18
 BUTTON_PIN = 17
 SERVO2_PIN = 21  # Nuevo pin para el segundo servo
+BUTTON_BOUNCE_TIME = 0.05  # Antirrebote del botón físico en segundos
+PRESS_QUEUE_SIZE = 0  # Pulsaciones que se guardan mientras otra sesión ocupa la pantalla (0 = se ignoran)
 
 # --- Configuración de Pygame ---
-import pygame
-pygame.init()
-info = pygame.display.Info()
-SCREEN_WIDTH = info.current_w
-SCREEN_HEIGHT = info.current_h
+# La resolución se obtiene al abrir la pantalla (hardware.screen_size), no al importar
+SDL_VIDEODRIVER = "x11"  # Driver de vídeo si el entorno no define otro
+DISPLAY_READY_TIMEOUT = 30  # Segundos máximos esperando al servidor gráfico
+# Plazo en segundos de cada componente en el arranque en paralelo
+STARTUP_TIMEOUTS = {
+    "servos": 5,
+    "boton": 5,
+    "impresora": 10,
+}
 
 # Colores
 BLACK = (0, 0, 0)
@@ -28,11 +93,33 @@ WHITE = (255, 255, 255)
 GRAY = (200, 200, 200)
 DARK_GRAY = (100, 100, 100)
 
+# Máximo de imágenes escaladas que se mantienen en memoria para la pantalla
+# (la biblioteca va en DISPLAY_FRAMES_DIR; aquí quedan la suscripción y las
+# imágenes añadidas con el kiosko en marcha)
+DISPLAY_CACHE_SIZE = 16
+
+# Directorio del fichero con todas las imágenes ya escaladas para la pantalla,
+# mapeado en memoria (pantalla.FrameStore)
+DISPLAY_FRAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "pantalla")
+
+# Espera máxima del bucle principal cuando la pantalla está en reposo (segundos)
+IDLE_MAX_WAIT = 5.0
+
+# Biblioteca de imágenes del botón; las que se añadan a la carpeta entran sin reiniciar
+IMAGES_DIR = "images"
+IMAGES_PATTERN = "imagen_*.png"
+# Cada cuánto se revisa la carpeta si inotify no está disponible (segundos)
+CATALOG_POLL_INTERVAL = 5
+
+# Hilos usados para precargar la biblioteca de imágenes al arrancar
+PREWARM_WORKERS = 2
+
+# Imagen que se muestra tras el botón en el modo "solo imagen"
+SUSCRIPCION_PATH = "/home/wintermute/tuboton/suscripcion.jpeg"
+
 # Configuración del botón en pantalla
 BUTTON_WIDTH = 200
 BUTTON_HEIGHT = 100
-BUTTON_X = (SCREEN_WIDTH - BUTTON_WIDTH) // 2
-BUTTON_Y = (SCREEN_HEIGHT - BUTTON_HEIGHT) // 2
 
 # Estilos de botones
 BUTTON_STYLES = {
@@ -114,6 +201,18 @@ BUTTON_STYLES = {
 QR_URL = "http://tuboton.karlosgliberal.com/"  # Cambiar por la URL real
 QR_SIZE = 3  # Tamaño del QR (1-10, donde 3 es tamaño mediano)
 QR_BORDER = 2  # Borde alrededor del QR en píxeles
+QR_NATIVE = False  # True: la impresora dibuja el QR (GS ( k) en lugar de recibir un raster
+
+# --- Selección de imágenes y estilos ---
+# Cada imagen y estilo sale en proporción a su peso (1 si no aparece, 0 lo
+# excluye; si todos son 0, cuentan como 1) y no se repite dentro de las últimas NO_REPEAT_* pulsaciones.
+# La posición se guarda en SELECTION_STATE_DIR y sigue tras reiniciar.
+IMAGE_WEIGHTS = {}  # Nombre del fichero -> peso, p. ej. {"imagen_7.png": 3}
+STYLE_WEIGHTS = {}  # Estilo de BUTTON_STYLES -> peso, p. ej. {"Brutalist": 2}
+NO_REPEAT_IMAGES = 30
+NO_REPEAT_STYLES = 4
+SELECTION_SEED = None  # Semilla fija para tener siempre la misma secuencia (pruebas)
+SELECTION_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "seleccion")
 
 # --- Sistema de Probabilidad ---
 # Probabilidades para las acciones del botón (deben sumar 100)
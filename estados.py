@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import heapq
+import logging
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger('tuboton')
+
+# === TABLA DE ESTADOS DE UNA SESIÓN ===
+# Una sesión es la interacción de un visitante desde que pulsa el botón hasta
+# que termina lo último que puso en marcha (pantalla, ticket o servos).
+
+# (estado, evento) -> estado siguiente. "timeout" lo dispara el temporizador
+# del estado; el resto de eventos son la acción elegida al pulsar.
+TRANSITIONS = {
+    ("neutral", "solo_imagen"): "waiting_suscripcion",
+    ("waiting_suscripcion", "timeout"): "suscripcion",
+    ("suscripcion", "timeout"): "neutral",
+
+    ("neutral", "ticket_qr"): "showing_qr",
+    ("showing_qr", "timeout"): "neutral",
+
+    ("neutral", "ticket_servos"): "waiting",
+    ("waiting", "timeout"): "turning",
+    ("turning", "timeout"): "returning",
+    ("returning", "timeout"): "hiding",
+    ("hiding", "timeout"): "neutral",
+
+    # Con SOLO_BOTON los servos se mueven en cuanto se pulsa
+    ("neutral", "ticket_servos_solo"): "servo_show",
+    ("servo_show", "timeout"): "neutral",
+}
+
+# Segundos que dura cada estado antes de su evento "timeout"
+STATE_TIMEOUTS = {
+    "waiting_suscripcion": 5,   # Imagen del botón antes de la suscripción
+    "suscripcion": 5,
+    "showing_qr": 6,
+    "waiting": 4,               # Espera antes de activar los servos
+    "turning": 2,
+    "returning": 0.5,
+    "hiding": 5,                # Imagen visible tras devolver los servos
+    "servo_show": 2,
+}
+
+# Estados en los que la sesión deja libre la pantalla: su imagen sigue a la
+# vista, pero la siguiente pulsación (o una en cola) empieza otra sesión que
+# la sustituye mientras los temporizadores de esta siguen corriendo. En
+# ticket_servos el ticket ya está en la cola de impresión al girar los servos.
+SCREEN_RELEASE_STATES = {"turning", "returning", "hiding"}
+
+# === MOTOR ===
+
+Transition = namedtuple('Transition', ['at', 'from_state', 'to_state', 'event'])
+
+class Session:
+    """Interacción de un visitante, con el historial de transiciones y sus marcas de tiempo"""
+
+    def __init__(self, session_id, action, image, pressed_at):
+        self.session_id = session_id
+        self.action = action
+        self.image = image
+        self.pressed_at = pressed_at
+        self.state = "neutral"
+        self.history = []
+
+    @property
+    def finished(self):
+        return bool(self.history) and self.state == "neutral"
+
+    def timeline(self):
+        """Resumen legible de la sesión: cada estado con su instante relativo a la pulsación"""
+        steps = [f"{t.to_state} +{t.at - self.pressed_at:.2f}s" for t in self.history]
+        return " → ".join(steps)
+
+class SessionMachine:
+    """Máquina de estados dirigida por tabla para las sesiones del botón
+
+    Los temporizadores de todas las sesiones vivas están en un montículo
+    ordenado por vencimiento, así que el bucle principal solo tiene que
+    despertarse cuando vence el primero (seconds_until_next). La pantalla
+    pertenece a una sesión a la vez (screen_owner) hasta que entra en uno de
+    release_states; a partir de ahí su imagen se sigue viendo (showing) hasta
+    que otra sesión toma la pantalla, y sus temporizadores siguen corriendo
+    en paralelo con los de la nueva.
+    """
+
+    def __init__(self, on_enter, transitions=TRANSITIONS, timeouts=STATE_TIMEOUTS, max_queued=0, keep_history=50,
+                 release_states=SCREEN_RELEASE_STATES):
+        self.on_enter = on_enter
+        self.transitions = transitions
+        self.timeouts = timeouts
+        self.max_queued = max_queued
+        self.release_states = release_states
+        self.sessions = {}
+        self.screen_owner = None
+        self.showing = None
+        self.pending_presses = deque()
+        self.recent = deque(maxlen=keep_history)
+        self._timers = []
+        self._next_id = 1
+        self._timer_seq = 0
+
+    @property
+    def screen_busy(self):
+        return self.screen_owner is not None
+
+    @property
+    def current_image(self):
+        """Imagen que debe verse en pantalla, o None"""
+        session = self.sessions.get(self.showing)
+        return session.image if session else None
+
+    def accept_press(self, press):
+        """Decide qué hacer con una pulsación: 'start', 'queued' o 'ignored'
+
+        Si queda en cola se guarda tal cual en pending_presses, para que
+        quien la saque pueda atenderla y registrarla como una pulsación más.
+        """
+        if not self.screen_busy:
+            return "start"
+        if len(self.pending_presses) < self.max_queued:
+            self.pending_presses.append(press)
+            return "queued"
+        return "ignored"
+
+    def start(self, action, image, pressed_at=None, now=None):
+        """Crea una sesión que toma la pantalla y le aplica la acción elegida"""
+        if now is None:
+            now = time.time()
+        session = Session(self._next_id, action, image, now if pressed_at is None else pressed_at)
+        self._next_id += 1
+        self.sessions[session.session_id] = session
+        self.screen_owner = session.session_id
+        self.showing = session.session_id
+        self._fire(session, action, now)
+        return session
+
+    def seconds_until_next(self, now):
+        """Segundos hasta el próximo temporizador, o None si no hay ninguno"""
+        if not self._timers:
+            return None
+        return max(0, self._timers[0][0] - now)
+
+    def run_due(self, now):
+        """Dispara los temporizadores vencidos, en orden de vencimiento"""
+        while self._timers and self._timers[0][0] <= now:
+            due, _, session_id, state = heapq.heappop(self._timers)
+            session = self.sessions.get(session_id)
+            # Temporizadores de estados que ya se abandonaron se descartan
+            if session is None or session.state != state:
+                continue
+            self._fire(session, "timeout", due)
+
+    def _fire(self, session, event, at):
+        next_state = self.transitions.get((session.state, event))
+        if next_state is None:
+            logger.warning(f"Sesión #{session.session_id}: evento '{event}' no válido en '{session.state}'")
+            return
+
+        session.history.append(Transition(at, session.state, next_state, event))
+        session.state = next_state
+        if next_state in self.release_states and self.screen_owner == session.session_id:
+            self.screen_owner = None
+        try:
+            self.on_enter(session, next_state)
+        except Exception as e:
+            logger.error(f"Sesión #{session.session_id}: error al entrar en '{next_state}': {str(e)}")
+
+        if next_state in self.timeouts:
+            # El siguiente vencimiento cuenta desde el instante previsto, sin deriva
+            self._timer_seq += 1
+            heapq.heappush(self._timers, (at + self.timeouts[next_state], self._timer_seq, session.session_id, next_state))
+        elif session.finished:
+            self._finish(session)
+
+    def _finish(self, session):
+        del self.sessions[session.session_id]
+        self.recent.append(session)
+        if self.screen_owner == session.session_id:
+            self.screen_owner = None
+        if self.showing == session.session_id:
+            self.showing = None
+        logger.info(f"Sesión #{session.session_id} ({session.action}): {session.timeline()}")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+import functools
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import pygame
+import usb.core
+from escpos.printer import Usb
+from gpiozero import AngularServo, Button
+from PIL import Image
+
+from config import (
+    VENDOR_ID, PRODUCT_ID, PRINTER_BACKEND, PRINTER_CAPTURE_PATH, PRINTER_CAPTURE_KBPS, PRINTER_CAPTURE_LATENCY,
+    SERVO_PIN, SERVO2_PIN, BUTTON_PIN, BUTTON_BOUNCE_TIME,
+    SDL_VIDEODRIVER, DISPLAY_READY_TIMEOUT, STARTUP_TIMEOUTS,
+    IMAGES_DIR, IMAGES_PATTERN, INGEST_DIR, DISPLAY_CACHE_SIZE, DISPLAY_FRAMES_DIR, RASTER_CACHE_DIR,
+)
+from biblioteca import ImageCatalog, ImageStore
+from captura import CaptureBus
+from impresora import PrinterSupervisor
+from pantalla import FrameStore, SurfaceCache
+from raster import RasterCache, RasterDiskCache
+
+logger = logging.getLogger('tuboton')
+
+# === INICIALIZACIÓN PEREZOSA ===
+# Nada de esto se ejecuta al importar: cada recurso se resuelve la primera vez
+# que se pide y se reutiliza después.
+
+def once(func):
+    """Ejecuta func una sola vez (aunque la pidan varios hilos) y recuerda el resultado"""
+    lock = threading.Lock()
+    result = []
+
+    @functools.wraps(func)
+    def wrapper():
+        with lock:
+            if not result:
+                result.append(func())
+            return result[0]
+    # Para limpiar solo lo que llegó a crearse
+    wrapper.created = lambda: bool(result)
+    return wrapper
+
+# === SERVOS, BOTÓN E IMPRESORA ===
+
+def setup_servo(pin):
+    try:
+        logger.info(f"Configurando servo en pin {pin}...")
+        servo = AngularServo(
+            pin=pin,
+            min_pulse_width=0.0005,
+            max_pulse_width=0.0025,
+            frame_width=0.02,
+            initial_angle=None,
+            min_angle=-90,
+            max_angle=90
+        )
+        logger.info(f"✓ Servo configurado correctamente en pin {pin}")
+        return servo
+    except Exception as e:
+        logger.error(f"Error al configurar el servo en pin {pin}: {str(e)}")
+        logger.error("Asegúrate de que:")
+        logger.error("1. Estás ejecutando el script con permisos de GPIO")
+        logger.error("2. El módulo gpiozero está instalado")
+        logger.error("3. El pin GPIO no está siendo usado por otro proceso")
+        raise
+
+def setup_printer():
+    try:
+        logger.info("Configurando impresora térmica...")
+        printer = Usb(VENDOR_ID, PRODUCT_ID, timeout=0, in_ep=0x81, out_ep=0x01)
+        logger.info("✓ Impresora configurada correctamente")
+        return printer
+    except usb.core.USBError as e:
+        if e.errno == 13:
+            logger.error("ERROR DE PERMISOS USB - El usuario no tiene permisos para acceder al dispositivo USB")
+            logger.error("Solución: Añadir usuario al grupo 'dialout' o configurar reglas udev")
+        elif e.errno == 19:
+            logger.warning("Impresora no encontrada - Continuando sin impresora")
+        else:
+            logger.error(f"Error USB no manejado: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error general al configurar la impresora: {str(e)}")
+        return None
+
+@once
+def capture_bus():
+    """Bus de la impresora simulada: uno solo, para que las reconexiones sigan capturando en el mismo sitio"""
+    os.makedirs(os.path.dirname(PRINTER_CAPTURE_PATH), exist_ok=True)
+    kbps = PRINTER_CAPTURE_KBPS
+    return CaptureBus(kbps * 1000 if kbps else None, latency=PRINTER_CAPTURE_LATENCY, sink=PRINTER_CAPTURE_PATH)
+
+def close_capture_bus():
+    """Vuelca y cierra el fichero de captura, si la impresora simulada llegó a abrirse"""
+    if capture_bus.created():
+        capture_bus().close()
+
+def setup_capture_printer():
+    logger.info(f"Configurando impresora simulada (bytes ESC/POS en {PRINTER_CAPTURE_PATH})...")
+    return capture_bus().connect()
+
+# Cómo se abre la impresora según PRINTER_BACKEND
+PRINTER_BACKENDS = {
+    "usb": setup_printer,
+    "captura": setup_capture_printer,
+}
+
+@once
+def get_servos():
+    """Servo 1 y servo 2"""
+    return setup_servo(SERVO_PIN), setup_servo(SERVO2_PIN)
+
+@once
+def get_button():
+    """Botón físico con antirrebote"""
+    return Button(BUTTON_PIN, bounce_time=BUTTON_BOUNCE_TIME)
+
+@once
+def get_printer():
+    """Supervisor de la impresora térmica, con un primer intento de conexión
+
+    Aunque la impresora no esté al arrancar, el supervisor la abrirá cuando
+    se enchufe y llegue el siguiente trabajo.
+    """
+    if PRINTER_BACKEND not in PRINTER_BACKENDS:
+        raise ValueError(f"Impresora desconocida: {PRINTER_BACKEND}")
+    supervisor = PrinterSupervisor(PRINTER_BACKENDS[PRINTER_BACKEND])
+    supervisor.try_connect()
+    return supervisor
+
+# === BIBLIOTECA Y CACHÉS ===
+
+@once
+def get_image_store():
+    """Imágenes de la biblioteca ya decodificadas, o None si el directorio no es accesible"""
+    try:
+        return ImageStore(INGEST_DIR)
+    except OSError as e:
+        logger.warning(f"Ingesta de imágenes no disponible: {str(e)}")
+        return None
+
+def open_image(image_path):
+    """Abre una imagen de la biblioteca, desde el almacén de ingesta si lo hay"""
+    store = get_image_store()
+    return store.open(image_path) if store else Image.open(image_path)
+
+@once
+def get_display_cache():
+    """Superficies escaladas para la pantalla: la biblioteca desde un fichero mapeado, el resto en caché"""
+    return SurfaceCache(DISPLAY_CACHE_SIZE, open_image, FrameStore(DISPLAY_FRAMES_DIR))
+
+@once
+def get_raster_cache():
+    """Caché de rasters para la impresora térmica, persistida en disco si el directorio es accesible"""
+    try:
+        disk_cache = RasterDiskCache(RASTER_CACHE_DIR)
+    except OSError as e:
+        logger.warning(f"Caché de rasters en disco no disponible: {str(e)}")
+        disk_cache = None
+    return RasterCache(disk_cache, open_image)
+
+@once
+def get_image_catalog():
+    """Imágenes del botón, indexadas una vez y vigiladas mientras corre el kiosko"""
+    return ImageCatalog(IMAGES_DIR, IMAGES_PATTERN, get_image_store())
+
+# === PANTALLA ===
+
+def wait_for_display(timeout=DISPLAY_READY_TIMEOUT):
+    """Espera a que el servidor gráfico acepte conexiones; devuelve los segundos esperados"""
+    os.environ.setdefault('SDL_VIDEODRIVER', SDL_VIDEODRIVER)
+    start = time.time()
+    delay = 0.05
+    while True:
+        try:
+            pygame.display.init()
+            return time.time() - start
+        except pygame.error as e:
+            if time.time() - start >= timeout:
+                raise RuntimeError(f"La pantalla no estuvo lista en {timeout}s: {str(e)}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+@once
+def screen_size():
+    """Resolución de la pantalla (ancho, alto)"""
+    wait_for_display()
+    info = pygame.display.Info()
+    return info.current_w, info.current_h
+
+@once
+def get_screen():
+    """Ventana a pantalla completa de Tu Botón"""
+    waited = wait_for_display()
+    logger.info(f"Pantalla lista tras {waited:.2f}s de espera")
+    screen = pygame.display.set_mode(screen_size(), pygame.FULLSCREEN)
+    pygame.display.set_caption("Tu Botón")
+    pygame.mouse.set_visible(False)  # Ocultar el cursor del mouse
+    return screen
+
+# === ARRANQUE EN PARALELO ===
+
+StartupStep = namedtuple('StartupStep', ['name', 'started', 'finished', 'status'])
+
+class Startup:
+    """Orquesta el arranque: cada componente se inicializa en su propio hilo
+
+    launch() lanza un componente y vuelve al momento; result() espera como
+    mucho hasta que vence su plazo (STARTUP_TIMEOUTS, contado desde que se
+    lanzó). Un componente opcional que falla o no llega a tiempo devuelve
+    None; uno obligatorio lanza RuntimeError. La pantalla se abre con run()
+    en el hilo principal, que es donde SDL espera tener la ventana.
+    """
+
+    def __init__(self, t0, timeouts=STARTUP_TIMEOUTS):
+        self.t0 = t0
+        self.timeouts = timeouts
+        self.steps = []
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="arranque")
+
+    def _timed(self, name, func, provides=True):
+        started = time.time()
+        try:
+            value = func()
+        except Exception:
+            self._record(name, started, "error")
+            raise
+        # Un componente que debía devolver algo y devolvió None no está disponible
+        self._record(name, started, "ok" if value is not None or not provides else "no disponible")
+        return value
+
+    def _record(self, name, started, status, finished=None):
+        with self._lock:
+            self.steps.append(StartupStep(name, started, finished or time.time(), status))
+
+    def launch(self, name, func, required=False, provides=True):
+        """Inicializa un componente en segundo plano"""
+        launched = time.time()
+        future = self._executor.submit(self._timed, name, func, provides)
+        self._pending[name] = (future, launched, required)
+
+    def run(self, name, func, provides=True):
+        """Inicializa un componente en el hilo actual, registrándolo en la línea de tiempo
+
+        provides=False para pasos que solo preparan algo y no devuelven nada.
+        """
+        return self._timed(name, func, provides)
+
+    def result(self, name):
+        """Espera al componente hasta su plazo y devuelve lo que produjo"""
+        future, launched, required = self._pending.pop(name)
+        timeout = self.timeouts.get(name)
+        remaining = None if timeout is None else max(0, launched + timeout - time.time())
+        try:
+            return future.result(remaining)
+        except FutureTimeout:
+            # El hilo sigue su curso, pero el arranque no le espera más
+            self._record(name, launched, f"sin respuesta en {timeout}s", time.time())
+            message = f"{name}: sin respuesta en {timeout}s"
+        except Exception as e:
+            message = f"{name}: {str(e)}"
+        if required:
+            raise RuntimeError(f"Arranque fallido - {message}")
+        logger.warning(f"Arranque: {message} - continuando sin este componente")
+        return None
+
+    def mark(self, name):
+        """Anota un hito sin duración (p. ej. el comienzo de la precarga)"""
+        now = time.time()
+        self._record(name, now, "ok", now)
+
+    def log_timeline(self):
+        """Escribe en el log cuándo empezó y acabó cada componente desde el arranque"""
+        self._executor.shutdown(wait=False)
+        logger.info("=== LÍNEA DE TIEMPO DE ARRANQUE ===")
+        with self._lock:
+            steps = sorted(self.steps, key=lambda step: step.started)
+        for step in steps:
+            logger.info(
+                f"{step.name:<12} +{step.started - self.t0:6.2f}s → +{step.finished - self.t0:6.2f}s "
+                f"({step.finished - step.started:5.2f}s) {step.status}"
+            )
+        logger.info(f"{'listo':<12} +{time.time() - self.t0:6.2f}s")
@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from functools import lru_cache
+
+import usb.core
+import usb.util
+from escpos.constants import RT_STATUS_ONLINE, RT_STATUS_PAPER, RT_MASK_ONLINE, RT_MASK_NOPAPER
+from escpos.exceptions import DeviceNotFoundError
+from escpos.printer import Dummy
+
+from raster import encode_bands
+
+from config import (
+    VENDOR_ID, PRODUCT_ID, DEFAULT_IMAGE_IMPL, PRINTER_PROFILES_PATH,
+    RASTER_BAND_HEIGHT, PRINTER_PACKETS_PER_WRITE, PRINTER_JOB_POLICY, PRINTER_REPLAY_ATTEMPTS,
+    PRINTER_RECONNECT_MIN, PRINTER_RECONNECT_MAX, PRINTER_RECONNECT_TIMEOUT,
+    PRINTER_PRINT_RATE, PRINTER_BUFFER_SIZE,
+    PRINTER_STATUS_WINDOW, PRINTER_STATUS_TIMEOUT, PRINTER_STATUS_POLL, PRINTER_STATUS_STALL,
+)
+
+logger = logging.getLogger('tuboton')
+
+# === COMPOSICIÓN DE TICKETS ===
+
+class Ticket(Dummy):
+    """Ticket compuesto en memoria cuyas imágenes se codifican por bandas al enviarlo
+
+    Textos y comandos se guardan como bytes; los rasters se guardan tal cual
+    y parts() los codifica banda a banda mientras se envían, así que la
+    impresora empieza con la primera banda y la memoria no crece con la
+    altura de la imagen. Recorrer parts() de nuevo da los mismos bytes, que
+    es lo que necesita el reenvío tras una desconexión.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._segments = []
+
+    def raster(self, raster, impl, band_height):
+        """Añade una imagen que se codificará al enviar el ticket"""
+        self._close_text()
+        self._segments.append((raster, impl, band_height))
+
+    def _close_text(self):
+        if self._output_list:
+            self._segments.append(b"".join(self._output_list))
+            self.clear()
+
+    def parts(self):
+        """Bytes ESC/POS del ticket, en trozos, tal como deben llegar a la impresora"""
+        self._close_text()
+        for segment in self._segments:
+            if isinstance(segment, bytes):
+                yield segment
+            else:
+                yield from encode_bands(*segment)
+
+    @property
+    def output(self):
+        return b"".join(self.parts())
+
+# Hueco de una plantilla, con la página de códigos activa en ese punto
+Slot = namedtuple('Slot', ['name', 'encoding'])
+
+class TicketTemplate(Ticket):
+    """Ticket compuesto una sola vez con huecos para lo que cambia en cada impresión
+
+    Se graba ejecutando el mismo código que escribe el ticket, con slot()
+    en lugar del contenido variable. python-escpos cambia de página de
+    códigos según el texto anterior, así que cada hueco recuerda la página
+    activa: lo que se escribe en él sale con los mismos bytes que si el
+    ticket se hubiera compuesto de principio a fin.
+    """
+
+    def slot(self, name):
+        self._close_text()
+        self._segments.append(Slot(name, self.magic.encoding))
+
+    def render(self, printer, fill):
+        """Escribe la plantilla en printer; fill(printer, nombre) rellena cada hueco"""
+        self._close_text()
+        for segment in self._segments:
+            if isinstance(segment, Slot):
+                filler = Ticket()
+                filler.magic.encoding = segment.encoding
+                fill(filler, segment.name)
+                if segment.encoding and filler.magic.encoding != segment.encoding:
+                    # El hueco cambió de página de códigos: volver a la que espera el resto
+                    filler.magic.write_with_encoding(segment.encoding, None)
+                _splice(printer, filler)
+            elif isinstance(segment, bytes):
+                printer._raw(segment)
+            else:
+                print_raster(printer, *segment)
+        printer.magic.encoding = self.magic.encoding
+
+def _splice(printer, ticket):
+    """Añade un ticket a otro, manteniendo sus rasters sin codificar si se puede"""
+    ticket._close_text()
+    if isinstance(printer, Ticket):
+        printer._close_text()
+        printer._segments.extend(ticket._segments)
+    else:
+        printer._raw(ticket.output)
+
+def print_raster(printer, raster, impl=None, band_height=RASTER_BAND_HEIGHT):
+    """Imprime un raster por bandas; en un Ticket la codificación se aplaza hasta el envío
+
+    Sin impl se usa el comando medido como más rápido para esta impresora.
+    """
+    impl = impl or image_impl()
+    if isinstance(printer, Ticket):
+        printer.raster(raster, impl, band_height)
+        return
+    for band in encode_bands(raster, impl, band_height):
+        printer._raw(band)
+
+def compose_ticket(handler, **params):
+    """Ejecuta un ticket sobre una impresora en memoria y devuelve (ok, Ticket)
+
+    El Ticket produce exactamente lo que recibiría la impresora, así que
+    también sirve como referencia para comparar tickets sin hardware.
+    """
+    ticket = Ticket()
+    ok = handler(ticket, **params)
+    return ok, ticket
+
+def bulk_chunk_size(printer):
+    """Tamaño de escritura: varios paquetes completos del endpoint de salida"""
+    packet_size = 64
+    try:
+        interface = printer.device.get_active_configuration()[(0, 0)]
+        endpoint = usb.util.find_descriptor(interface, bEndpointAddress=printer.out_ep)
+        packet_size = endpoint.wMaxPacketSize
+    except Exception as e:
+        logger.warning(f"No se pudo leer el endpoint USB, usando paquetes de {packet_size} bytes: {str(e)}")
+    return packet_size * PRINTER_PACKETS_PER_WRITE
+
+def rechunk(parts, chunk_size):
+    """Agrupa trozos de un ticket en bloques de chunk_size bytes (el último puede ser menor)"""
+    pending = bytearray()
+    for part in parts:
+        pending += part
+        while len(pending) >= chunk_size:
+            yield bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+    if pending:
+        yield bytes(pending)
+
+def write_bulk(printer, parts, chunk_size):
+    """Envía los trozos de un ticket en transferencias grandes; devuelve los bytes enviados"""
+    sent = 0
+    for chunk in rechunk(parts, chunk_size):
+        printer._raw(chunk)
+        sent += len(chunk)
+    return sent
+
+class PrintPacer:
+    """Estimación de los bytes que la impresora todavía no ha impreso
+
+    La impresora no informa de cuánto tiene en el buffer, así que se supone
+    que lo vacía a rate bytes por segundo. delay() dice cuánto esperar antes
+    de enviar más para que nunca haya más de buffer_size bytes pendientes
+    (un bloque mayor que el buffer espera a que esté vacío). Sin rate no se
+    limita nada.
+    """
+
+    def __init__(self, rate=PRINTER_PRINT_RATE, buffer_size=PRINTER_BUFFER_SIZE):
+        self.rate = rate
+        self.buffer_size = buffer_size
+        self.level = 0
+        self._level_at = time.monotonic()
+
+    def _drain(self):
+        now = time.monotonic()
+        if self.rate:
+            self.level = max(0, self.level - (now - self._level_at) * self.rate)
+        self._level_at = now
+
+    def delay(self, size):
+        """Segundos que hay que esperar antes de enviar size bytes"""
+        if not self.rate:
+            return 0
+        self._drain()
+        excess = self.level - max(0, self.buffer_size - size)
+        return max(0, excess) / self.rate
+
+    def sent(self, size):
+        self._drain()
+        self.level += size
+
+    def reset(self):
+        """Impresora recién conectada: buffer vacío"""
+        self.level = 0
+        self._level_at = time.monotonic()
+
+def write_paced(printer, parts, chunk_size, pacer, pause, wait_ready=None, window=PRINTER_STATUS_WINDOW):
+    """Como write_bulk, pero sin adelantarse a la impresora
+
+    Antes de cada bloque espera (con pause) lo que pacer estima que tarda en
+    haber sitio en el buffer. DLE EOT es un comando en tiempo real: la
+    impresora lo contesta al momento aunque tenga datos pendientes, así que
+    wait_ready solo detiene el envío si está fuera de línea o sin papel; no
+    dice cuánto queda por imprimir. ESC/POS no admite comandos en tiempo
+    real dentro de los datos de una imagen, así que wait_ready solo se
+    llama al terminar un trozo de parts() (cada trozo es un comando o una
+    banda completa), una vez enviados al menos window bytes desde la
+    anterior consulta.
+    """
+    sent = 0
+    unchecked = 0
+    pending = bytearray()
+
+    def send(block):
+        nonlocal sent, unchecked
+        delay = pacer.delay(len(block))
+        if delay:
+            pause(delay)
+        printer._raw(block)
+        pacer.sent(len(block))
+        sent += len(block)
+        unchecked += len(block)
+
+    for part in parts:
+        pending += part
+        while len(pending) >= chunk_size:
+            send(bytes(pending[:chunk_size]))
+            del pending[:chunk_size]
+        # Fin de un comando: el único sitio donde se puede intercalar DLE EOT
+        if wait_ready and unchecked + len(pending) >= window:
+            if pending:
+                send(bytes(pending))
+                pending.clear()
+            wait_ready()
+            unchecked = 0
+    if pending:
+        send(bytes(pending))
+    return sent
+
+# === ESTADO EN TIEMPO REAL ===
+
+def query_status(printer, request, timeout):
+    """Consulta de estado en tiempo real (DLE EOT n) por el endpoint de entrada
+
+    Devuelve el byte de estado, o None si la impresora no contesta en timeout
+    segundos. Antes de preguntar se descarta cualquier respuesta atrasada de
+    una consulta anterior que agotó su espera, para no tomarla por esta.
+    """
+    discard_replies(printer)
+    printer._raw(request)
+    try:
+        reply = printer.device.read(printer.in_ep, 16, int(timeout * 1000))
+    except usb.core.USBTimeoutError:
+        return None
+    return reply[0] if len(reply) else None
+
+def discard_replies(printer, max_reads=8):
+    """Vacía el endpoint de entrada de respuestas que llegaron tarde"""
+    for _ in range(max_reads):
+        try:
+            stale = printer.device.read(printer.in_ep, 16, 1)
+        except usb.core.USBTimeoutError:
+            return
+        if not len(stale):
+            return
+        logger.debug(f"Descartada respuesta de estado atrasada: {bytes(stale).hex()}")
+
+def offline_reason(printer):
+    """Motivo por el que la impresora está fuera de línea, según el sensor de papel"""
+    paper = query_status(printer, RT_STATUS_PAPER, PRINTER_STATUS_TIMEOUT)
+    if paper is not None and paper & RT_MASK_NOPAPER == RT_MASK_NOPAPER:
+        return "sin papel"
+    return "fuera de línea"
+
+# === COMANDO DE IMAGEN POR IMPRESORA ===
+
+# Comandos de imagen que sabe generar encode_bands
+IMAGE_IMPLS = ("bitImageColumn", "bitImageRaster", "graphics")
+
+def printer_key(vendor_id, product_id):
+    """Clave de una impresora en los perfiles: VID:PID en hexadecimal"""
+    return f"{vendor_id:04x}:{product_id:04x}"
+
+def load_printer_profiles(path=PRINTER_PROFILES_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_printer_profile(vendor_id, product_id, profile, path=PRINTER_PROFILES_PATH):
+    """Guarda las medidas de una impresora sin tocar las del resto"""
+    profiles = load_printer_profiles(path)
+    profiles[printer_key(vendor_id, product_id)] = profile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, path)
+    image_impl.cache_clear()
+
+@lru_cache(maxsize=None)
+def image_impl(vendor_id=VENDOR_ID, product_id=PRODUCT_ID):
+    """Comando de imagen más rápido medido para la impresora, o DEFAULT_IMAGE_IMPL"""
+    profile = load_printer_profiles().get(printer_key(vendor_id, product_id), {})
+    impl = profile.get("impl", DEFAULT_IMAGE_IMPL)
+    if impl not in IMAGE_IMPLS:
+        logger.warning(f"Comando de imagen desconocido en el perfil de la impresora: {impl}")
+        return DEFAULT_IMAGE_IMPL
+    return impl
+
+# === CONEXIÓN CON LA IMPRESORA ===
+
+# Errores que significan que el manejador USB ya no sirve (cable fuera, reinicio...).
+# python-escpos usa assert cuando el dispositivo no llegó a abrirse.
+USB_ERRORS = (usb.core.USBError, DeviceNotFoundError, AssertionError)
+
+class PrinterDisconnected(Exception):
+    """La impresora no está conectada o se perdió en mitad de una escritura"""
+
+class PrinterSupervisor:
+    """Dueño del manejador USB de la impresora; lo reabre cuando se pierde
+
+    connect() debe devolver una impresora nueva (o None). Si una escritura
+    falla con un error USB se cierra el manejador y los intentos de
+    reconexión se espacian con espera exponencial entre reconnect_min y
+    reconnect_max segundos, así que desenchufar la impresora no bloquea
+    nada ni satura el bus con intentos.
+    """
+
+    def __init__(self, connect, reconnect_min=PRINTER_RECONNECT_MIN, reconnect_max=PRINTER_RECONNECT_MAX,
+                 print_rate=PRINTER_PRINT_RATE, buffer_size=PRINTER_BUFFER_SIZE):
+        self.connect = connect
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.printer = None
+        self.connects = 0
+        self.disconnects = 0
+        self.status_supported = False
+        self.status_queries = 0
+        self.paused_seconds = 0.0
+        self.pacer = PrintPacer(print_rate, buffer_size)
+        self._chunk_size = None
+        self._delay = reconnect_min
+        self._next_attempt = 0
+        self._stopping = threading.Event()
+
+    @property
+    def connected(self):
+        return self.printer is not None
+
+    def try_connect(self):
+        """Un único intento de abrir la impresora; True si quedó conectada"""
+        if self.connected:
+            return True
+        try:
+            printer = self.connect()
+            if printer is None:
+                raise PrinterDisconnected("no se pudo crear la impresora")
+            # python-escpos abre el dispositivo USB en el primer acceso
+            printer.device
+        except Exception as e:
+            self._next_attempt = time.time() + self._delay
+            logger.warning(f"Impresora no disponible, reintento en {self._delay:.1f}s: {str(e)}")
+            self._delay = min(self._delay * 2, self.reconnect_max)
+            return False
+
+        self.printer = printer
+        self._chunk_size = bulk_chunk_size(printer)
+        self.status_supported = self._probe_status()
+        self.pacer.reset()
+        self.connects += 1
+        self._delay = self.reconnect_min
+        self._next_attempt = 0
+        if self.connects > 1:
+            logger.info(f"✓ Impresora reconectada (conexión #{self.connects})")
+        return True
+
+    def _probe_status(self):
+        """Comprueba si la impresora contesta a DLE EOT para pausar el envío si se queda sin papel"""
+        try:
+            reply = query_status(self.printer, RT_STATUS_ONLINE, PRINTER_STATUS_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"No se pudo consultar el estado de la impresora: {str(e)}")
+            reply = None
+        if reply is None:
+            logger.warning("La impresora no responde a DLE EOT - enviando sin consultar su estado")
+            return False
+        return True
+
+    def wait_until_ready(self):
+        """Espera a que la impresora esté en línea y con papel
+
+        Mientras esté fuera de línea (tapa abierta, sin papel) o sin contestar
+        se sigue consultando cada PRINTER_STATUS_POLL segundos; pasados
+        PRINTER_STATUS_STALL segundos se da el trabajo por interrumpido.
+        """
+        deadline = time.time() + PRINTER_STATUS_STALL
+        paused_at = None
+        while True:
+            status = query_status(self.printer, RT_STATUS_ONLINE, PRINTER_STATUS_TIMEOUT)
+            self.status_queries += 1
+            if status is not None and not status & RT_MASK_ONLINE:
+                break
+            reason = offline_reason(self.printer) if status is not None else "sin respuesta"
+            if paused_at is None:
+                paused_at = time.time()
+                logger.warning(f"Impresora {reason} - pausando el envío")
+            if time.time() >= deadline:
+                raise PrinterDisconnected(f"impresora {reason} durante {PRINTER_STATUS_STALL}s")
+            if self._stopping.wait(PRINTER_STATUS_POLL):
+                raise PrinterDisconnected("cerrando")
+        if paused_at is not None:
+            paused = time.time() - paused_at
+            self.paused_seconds += paused
+            logger.info(f"Impresora lista de nuevo tras {paused:.1f}s - reanudando el envío")
+
+    def _pause(self, seconds):
+        if self._stopping.wait(seconds):
+            raise PrinterDisconnected("cerrando")
+
+    def wait_until_printed(self):
+        """Espera a que la impresora haya impreso (según la estimación) todo lo enviado"""
+        self._pause(self.pacer.delay(self.pacer.buffer_size))
+
+    def ensure_connected(self, timeout):
+        """Reintenta respetando la espera exponencial hasta conectar o agotar timeout"""
+        deadline = time.time() + timeout
+        while not self.connected:
+            now = time.time()
+            if now >= self._next_attempt and self.try_connect():
+                break
+            wait = self._next_attempt - time.time()
+            if time.time() + wait > deadline or self._stopping.wait(wait):
+                return False
+        return True
+
+    def write(self, parts):
+        """Envía un ticket completo a partir de sus trozos y devuelve los bytes enviados
+
+        Lanza PrinterDisconnected si se pierde la impresora.
+        """
+        if not self.connected:
+            raise PrinterDisconnected("impresora no conectada")
+        try:
+            wait_ready = self.wait_until_ready if self.status_supported else None
+            if wait_ready:
+                wait_ready()
+            if wait_ready or self.pacer.rate:
+                sent = write_paced(self.printer, parts, self._chunk_size, self.pacer, self._pause, wait_ready)
+            else:
+                sent = write_bulk(self.printer, parts, self._chunk_size)
+        except USB_ERRORS as e:
+            self.drop(str(e))
+            raise PrinterDisconnected(str(e))
+        # Las impresoras sobre fichero (escpos File, la simulada) vuelcan cada ticket entero
+        flush = getattr(self.printer, "flush", None)
+        if flush:
+            flush()
+        return sent
+
+    def drop(self, reason):
+        """Cierra el manejador actual; el siguiente trabajo intentará reconectar"""
+        self.disconnects += 1
+        logger.warning(f"Impresora desconectada: {reason}")
+        try:
+            self.printer.close()
+        except Exception:
+            pass
+        self.printer = None
+
+    def close(self):
+        """Cierra la impresora y corta cualquier espera de reconexión"""
+        self._stopping.set()
+        if self.printer:
+            self.printer.close()
+            self.printer = None
+
+# === COLA DE IMPRESIÓN ===
+
+PrintJob = namedtuple('PrintJob', ['job_id', 'kind', 'params', 'enqueued_at'])
+
+# Medidas de un trabajo terminado: segundos en cola, componiendo y enviando
+JobStats = namedtuple('JobStats', ['job_id', 'kind', 'ok', 'bytes', 'wait', 'compose', 'send', 'finished_at'])
+
+class PrintQueue:
+    """Cola de trabajos de impresión atendida por un único hilo dueño de la impresora
+
+    El bucle de Pygame solo encola una descripción del trabajo (tipo y
+    parámetros); el hilo compone el ticket completo con handlers[kind] y lo
+    envía a la impresora de una vez.
+
+    Sin impresora, cada trabajo espera a que vuelva hasta
+    PRINTER_RECONNECT_TIMEOUT. Si se desconecta en mitad de un ticket, policy
+    decide qué pasa con él: "replay" lo reenvía entero al reconectar, como
+    mucho PRINTER_REPLAY_ATTEMPTS veces; "discard" lo da por perdido y sigue
+    con el siguiente.
+
+    stats guarda un JobStats por cada uno de los últimos trabajos: bytes
+    enviados y tiempos de espera, composición y envío.
+    """
+
+    def __init__(self, supervisor, handlers, policy=PRINTER_JOB_POLICY, keep_stats=500):
+        if policy not in ("replay", "discard"):
+            raise ValueError(f"Política de impresión desconocida: {policy}")
+        self.supervisor = supervisor
+        self.handlers = handlers
+        self.policy = policy
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.jobs_replayed = 0
+        self.stats = deque(maxlen=keep_stats)
+        self._queue = queue.Queue()
+        self._next_id = 1
+        self._thread = threading.Thread(target=self._run, name="impresora", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self):
+        """Trabajos pendientes en la cola"""
+        return self._queue.qsize()
+
+    def submit(self, kind, **params):
+        """Encola un trabajo y vuelve inmediatamente"""
+        if kind not in self.handlers:
+            raise ValueError(f"Tipo de trabajo de impresión desconocido: {kind}")
+        job = PrintJob(self._next_id, kind, params, time.time())
+        self._next_id += 1
+        self._queue.put(job)
+        logger.info(f"Trabajo #{job.job_id} ({kind}) encolado - profundidad de cola: {self._queue.qsize()}")
+        return job
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            self._process(job)
+
+    def _process(self, job):
+        started_at = time.time()
+        composed_at = None
+        sent = 0
+        try:
+            ok, ticket = compose_ticket(self.handlers[job.kind], **job.params)
+            composed_at = time.time()
+            # Lo compuesto se envía aunque el ticket haya fallado a medias, como antes
+            sent = self._send(job, ticket)
+        except PrinterDisconnected as e:
+            logger.error(f"Trabajo #{job.job_id} ({job.kind}) descartado, impresora no disponible: {str(e)}")
+            ok = False
+        except Exception as e:
+            logger.error(f"Trabajo #{job.job_id} ({job.kind}) falló: {str(e)}")
+            ok = False
+        finished_at = time.time()
+        composed_at = composed_at or finished_at
+
+        if ok:
+            self.jobs_done += 1
+        else:
+            self.jobs_failed += 1
+        stats = JobStats(
+            job.job_id, job.kind, ok, sent, started_at - job.enqueued_at,
+            composed_at - started_at, finished_at - composed_at, finished_at,
+        )
+        self.stats.append(stats)
+        logger.info(
+            f"Trabajo #{job.job_id} ({job.kind}) {'completado' if ok else 'FALLIDO'} - "
+            f"espera {stats.wait:.2f}s, composición {stats.compose * 1000:.1f} ms, "
+            f"impresión {stats.send:.2f}s ({sent} bytes), "
+            f"pendientes {self._queue.qsize()}, totales {self.jobs_done} ok / {self.jobs_failed} fallidos"
+        )
+
+    def _send(self, job, ticket):
+        attempts = 0
+        while True:
+            # Todo trabajo espera a la impresora; la política solo decide qué pasa con el interrumpido
+            if not self.supervisor.ensure_connected(PRINTER_RECONNECT_TIMEOUT):
+                raise PrinterDisconnected("sin conexión")
+            try:
+                return self.supervisor.write(ticket.parts())
+            except PrinterDisconnected:
+                attempts += 1
+                if self.policy != "replay" or attempts > PRINTER_REPLAY_ATTEMPTS:
+                    raise
+                self.jobs_replayed += 1
+                logger.warning(f"Trabajo #{job.job_id} ({job.kind}): reenviando tras desconexión (intento {attempts})")
+
+    def stop(self, timeout=10):
+        """Termina el hilo después de los trabajos ya encolados"""
+        self._queue.put(None)
+        self._thread.join(timeout)
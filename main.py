@@ -1,25 +1,34 @@
 #!/usr/bin/env python3
 
 import time
+# Referencia para medir el tiempo de arranque hasta quedar listo
+START_TIME = time.time()
+
 import sys
 import pygame
-from gpiozero import AngularServo, Button
 from config import *
 
 # Importar funciones directas sin clases por ahora
-import usb.core
-import usb.util
-from escpos.printer import Usb
-from PIL import Image, ImageEnhance, ImageOps
-import glob
 import random
 import os
-import uuid
-import datetime
-import qrcode
 import logging
 import signal
 import atexit
+from pantalla import Renderer
+from biblioteca import prewarm_library, start_prewarm
+from impresora import PrintQueue, image_impl
+from maquetacion import prerender_static
+from tickets import TicketPrinter, compile_art_templates
+from servos import ServoMotion
+from boton import ButtonEvents, ButtonPress
+from estados import SessionMachine
+from seleccion import ShuffleBag
+from hardware import (
+    once, close_capture_bus, get_servos, get_button, get_printer, get_screen, Startup,
+    get_display_cache, get_raster_cache, get_image_catalog,
+)
+
+logger = logging.getLogger('tuboton')
 
 # === CONFIGURACIÓN DE LOGGING PARA AUTOARRANQUE ===
 def setup_logging():
@@ -51,7 +60,12 @@ def cleanup_and_exit():
     try:
         logger.info("Iniciando limpieza de recursos...")
         
-        # Limpiar servos si existen
+        # Resumen de latencias del botón
+        if 'button_events' in globals() and button_events:
+            button_events.report()
+        
+        # Descartar movimientos pendientes y limpiar servos si existen
+        servo_motion.cancel()
         if 'servo' in globals() and servo:
             detach_servo(servo)
             logger.info("Servo 1 desactivado")
@@ -60,10 +74,20 @@ def cleanup_and_exit():
             detach_servo(servo2)
             logger.info("Servo 2 desactivado")
         
+        # Dejar de vigilar la carpeta de imágenes
+        if get_image_catalog.created():
+            get_image_catalog().stop()
+        
+        # Terminar los trabajos de impresión pendientes
+        if 'print_queue' in globals() and print_queue:
+            print_queue.stop()
+            logger.info("Cola de impresión detenida")
+        
         # Cerrar impresora si existe
         if 'printer' in globals() and printer:
             printer.close()
             logger.info("Impresora cerrada")
+        close_capture_bus()
         
         # Cerrar pygame
         pygame.quit()
@@ -76,13 +100,8 @@ def cleanup_and_exit():
     
     sys.exit(0)
 
-# Configurar manejadores de señales
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
-atexit.register(cleanup_and_exit)
-
-# Inicializar logging
-logger = setup_logging()
+# Movimientos de servo planificados, avanzados en cada vuelta del bucle principal
+servo_motion = ServoMotion()
 
 # === VERIFICACIONES DE DEPENDENCIAS ===
 def check_environment():
@@ -91,25 +110,20 @@ def check_environment():
         logger.info("Verificando entorno de ejecución...")
         
         # Verificar directorio de imágenes
-        if not os.path.exists("images"):
-            logger.error("Directorio 'images' no encontrado")
+        if not os.path.exists(IMAGES_DIR):
+            logger.error(f"Directorio '{IMAGES_DIR}' no encontrado")
             return False
         
-        # Verificar que hay imágenes
-        image_pattern = os.path.join("images", "imagen_*.png")
-        images = glob.glob(image_pattern)
-        if not images:
-            logger.error("No se encontraron imágenes en el directorio 'images'")
+        # Verificar que hay imágenes (el catálogo se carga durante el arranque)
+        if not get_image_catalog().has_files():
+            logger.error(f"No se encontraron imágenes en el directorio '{IMAGES_DIR}'")
             return False
         
-        logger.info(f"Encontradas {len(images)} imágenes")
-        
         # Verificar imagen de suscripción
-        suscripcion_path = "/home/wintermute/tuboton/suscripcion.jpeg"
-        if os.path.exists(suscripcion_path):
+        if os.path.exists(SUSCRIPCION_PATH):
             logger.info("Imagen de suscripción encontrada")
         else:
-            logger.warning("Imagen de suscripción no encontrada en /home/wintermute/tuboton/suscripcion.jpeg")
+            logger.warning(f"Imagen de suscripción no encontrada en {SUSCRIPCION_PATH}")
         
         # Verificar permisos de usuario
         try:
@@ -128,481 +142,147 @@ def check_environment():
 
 # === FUNCIONES EXACTAS DEL CÓDIGO ORIGINAL ===
 
+def selection_state(name):
+    """Fichero donde se guarda la posición de una bolsa, o None para no guardarla"""
+    return os.path.join(SELECTION_STATE_DIR, f"{name}.json") if SELECTION_STATE_DIR else None
+
+def image_weight(image_path):
+    return IMAGE_WEIGHTS.get(os.path.basename(image_path), 1)
+
+def selection_weights(items, weights, key, what):
+    """Peso de cada elemento según weights (por key(elemento), 1 si no aparece)
+
+    Avisa de los nombres de weights que no corresponden a ningún elemento
+    (seguramente una errata) y, si todos los pesos quedan a 0, usa peso 1
+    para todos en vez de dejar la bolsa vacía.
+    """
+    unknown = sorted(set(weights) - {key(item) for item in items})
+    if unknown:
+        logger.warning(f"Pesos de {what} que no corresponden a ninguno (¿errata?): {', '.join(map(str, unknown))}")
+    result = {item: weights.get(key(item), 1) for item in items}
+    if result and not any(weight > 0 for weight in result.values()):
+        logger.warning(f"Todos los pesos de {what} son 0 - se usa peso 1 para todos")
+        result = dict.fromkeys(result, 1)
+    return result
+
+@once
+def image_bag():
+    """Bolsa de imágenes del catálogo, al día con lo que entra y sale de la carpeta"""
+    weights = selection_weights(get_image_catalog().paths(), IMAGE_WEIGHTS, os.path.basename, "imágenes")
+    bag = ShuffleBag(weights, NO_REPEAT_IMAGES, SELECTION_SEED, selection_state("imagenes"))
+
+    def follow_catalog(event, entry):
+        if event == "added":
+            bag.add(entry.path, image_weight(entry.path))
+        else:
+            bag.discard(entry.path)
+    get_image_catalog().subscribe(follow_catalog)
+    return bag
+
+@once
+def style_bag():
+    """Bolsa de estilos de BUTTON_STYLES"""
+    weights = selection_weights(BUTTON_STYLES, STYLE_WEIGHTS, str, "estilos")
+    return ShuffleBag(weights, NO_REPEAT_STYLES, SELECTION_SEED, selection_state("estilos"))
+
 def get_random_style():
-    """Selecciona un estilo aleatorio del diccionario de estilos."""
-    style_name = random.choice(list(BUTTON_STYLES.keys()))
+    """Selecciona el siguiente estilo de la bolsa (ponderado y sin repetir los últimos)."""
+    style_name = style_bag().draw()
+    if style_name is None:
+        # Bolsa vacía: al azar, como antes de las bolsas
+        style_name = random.choice(list(BUTTON_STYLES))
     return style_name, BUTTON_STYLES[style_name]
 
-def setup_servo(pin):
-    try:
-        logger.info(f"Configurando servo en pin {pin}...")
-        servo = AngularServo(
-            pin=pin,
-            min_pulse_width=0.0005,
-            max_pulse_width=0.0025,
-            frame_width=0.02,
-            initial_angle=None,
-            min_angle=-90,
-            max_angle=90
-        )
-        logger.info(f"✓ Servo configurado correctamente en pin {pin}")
-        return servo
-    except Exception as e:
-        logger.error(f"Error al configurar el servo en pin {pin}: {str(e)}")
-        logger.error("Asegúrate de que:")
-        logger.error("1. Estás ejecutando el script con permisos de GPIO")
-        logger.error("2. El módulo gpiozero está instalado")
-        logger.error("3. El pin GPIO no está siendo usado por otro proceso")
-        raise
-
-def move_servo_smoothly(servo, target_angle, steps=5, delay=0.05):
-    """Mueve el servo suavemente al ángulo objetivo"""
-    try:
-        current_angle = servo.angle if servo.angle is not None else -90
-        step_size = (target_angle - current_angle) / steps
-        
-        for i in range(steps):
-            servo.angle = current_angle + (step_size * (i + 1))
-            time.sleep(delay)
-    except Exception as e:
-        logger.error(f"Error al mover el servo: {str(e)}")
-
 def detach_servo(servo):
-    """Desactiva el servo estableciendo el ángulo a None"""
+    """Desactiva el servo al momento, sin esperar a que se asiente (la limpieza no espera)"""
     try:
         servo.angle = None
-        time.sleep(0.1)
     except Exception as e:
         logger.error(f"Error al desactivar servo: {str(e)}")
 
-def setup_printer():
-    try:
-        logger.info("Configurando impresora térmica...")
-        printer = Usb(VENDOR_ID, PRODUCT_ID, timeout=0, in_ep=0x81, out_ep=0x01)
-        logger.info("✓ Impresora configurada correctamente")
-        return printer
-    except usb.core.USBError as e:
-        if e.errno == 13:
-            logger.error("ERROR DE PERMISOS USB - El usuario no tiene permisos para acceder al dispositivo USB")
-            logger.error("Solución: Añadir usuario al grupo 'dialout' o configurar reglas udev")
-        elif e.errno == 19:
-            logger.warning("Impresora no encontrada - Continuando sin impresora")
-        else:
-            logger.error(f"Error USB no manejado: {str(e)}")
-        return None
-    except Exception as e:
-        logger.error(f"Error general al configurar la impresora: {str(e)}")
-        return None
-
-def print_debug(printer):
-    """Imprime solo el título en modo debug"""
-    printer.set(align='center')
-    printer.text("*** TU BOTÓN ***\n")
-    printer.text("\n" * 3)
-    return True
-
-def print_image(printer, image_path):
-    """Procesa e imprime una imagen en la impresora térmica."""
-    try:
-        print(f"Procesando imagen: {image_path}")
-        img = Image.open(image_path)
-
-        # Convertir a escala de grises (L)
-        img = img.convert('L')
-
-        # Ajustar tamaño
-        max_width = 384
-        width, height = img.size
-        print(f"Tamaño original de la imagen: {width}x{height}")
-        if width > max_width:
-            ratio = max_width / width
-            new_height = int(height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            print(f"Imagen redimensionada a: {max_width}x{new_height}")
-        else:
-            print("La imagen no necesita redimensionarse.")
-
-        # Aumentar contraste significativamente
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(2.5)  # Aumentado de 1.5 a 2.5
-
-        # Ajustar brillo para hacer la imagen más oscura
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(0.8)  # Valor < 1 hace la imagen más oscura
-
-        # Convertir a binario con un umbral más bajo para obtener más píxeles negros
-        threshold = 150  # Reducido de 180 a 150
-        img = img.point(lambda x: 0 if x < threshold else 255, '1')
-
-        # Invertir el resultado
-        img = ImageOps.invert(img)
-
-        # Imprimir la imagen
-        printer.set(align='center')
-        printer.image(img, impl="bitImageColumn")
-        printer.text("\n")
-        print("Imagen procesada e impresa con éxito")
-        return True
-
-    except FileNotFoundError:
-        print(f"Error: No se encontró el archivo de imagen en '{image_path}'")
-        return False
-    except Exception as e:
-        print(f"Error detallado al procesar/imprimir la imagen: {str(e)}")
-        return False
-
 def get_random_image():
-    """Selecciona una imagen aleatoria del directorio images."""
+    """Selecciona la siguiente imagen de la bolsa (ponderada y sin repetir las últimas)."""
     try:
-        # Obtener todas las imágenes que coincidan con el patrón
-        image_pattern = os.path.join("images", "imagen_*.png")
-        images = glob.glob(image_pattern)
+        random_image = image_bag().draw()
         
-        if not images:
+        if not random_image:
             print("No se encontraron imágenes en el directorio images")
             return None
             
-        # Seleccionar una imagen aleatoria
-        random_image = random.choice(images)
         print(f"Imagen seleccionada: {random_image}")
         return random_image
     except Exception as e:
         print(f"Error al seleccionar imagen aleatoria: {e}")
         return None
 
-def print_art_ticket(printer, estilo_base=None, imagen_path=None):
-    """Imprime el ticket completo con el diseño artístico."""
-    try:
-        print("\n--- Iniciando impresión del ticket artístico ---")
-        
-        # 1. Resetear y configurar inicio
-        printer.set(align='center')
-        
-        # En modo debug solo imprimimos el título
-        if DEBUG_MODE:
-            printer.text("*** TU BOTÓN ***\n")
-            printer.text("\n" * 3)  # Avance de papel
-            return True
-
-        # Seleccionar estilo aleatorio si no se especifica uno
-        if estilo_base is None:
-            estilo_base, estilo_info = get_random_style()
-        else:
-            estilo_info = BUTTON_STYLES.get(estilo_base, {
-                "desc": "undefined style",
-                "ref": "mixed reference",
-                "style_text": "custom style",
-                "prompt": "Use undefined style with custom parameters"
-            })
-
-        # 2. Encabezado
-        printer.text("*** TU BOTÓN ***\n")
-        printer.text("--------------------\n")
-        printer.text("Instancia Generativa Única\n\n")
-
-        # 3. Imprimir la imagen
-        # Usar la imagen pasada como parámetro o seleccionar una nueva
-        imagen_generada = imagen_path if imagen_path else get_random_image()
-        if imagen_generada:
-            if not print_image(printer, imagen_generada):
-                printer.set(align='center')
-                printer.text("[------------------------]\n")
-                printer.text("[     (Aquí iría la      ]\n")
-                printer.text("[   imagen del botón     ]\n")
-                printer.text("[    generado, ~50mm)    ]\n")
-                printer.text("[------------------------]\n\n")
-        else:
-            printer.set(align='center')
-            printer.text("[------------------------]\n")
-            printer.text("[     (Aquí iría la      ]\n")
-            printer.text("[   imagen del botón     ]\n")
-            printer.text("[    generado, ~50mm)    ]\n")
-            printer.text("[------------------------]\n\n")
-
-        # 4. Información del Diseño
-        printer.text("*** DISEÑO ***\n\n")
-
-        # Generar UUID corto para la instancia
-        id_instancia = str(uuid.uuid4())[:8]
-
-        printer.set(align='left')
-        printer.text(f"ID_Instancia.: {id_instancia}\n")
-        printer.text(f"Sistema Base.: {estilo_base}\n")
-        
-        printer.text("\n--- Atributos ---\n")
-        printer.text(f"Estética.....: {estilo_info['desc']}\n")
-        printer.text(f"Referencia...: {estilo_info['ref']}\n")
-        printer.text(f"Estilo.......: {estilo_info['style_text']}\n")
-        printer.text(f"Mediación....: Maquínica\n")
-        printer.text(f"Materialidad.: Tinta/Papel APLI 13323\n\n")
-
-        # 5. Sección Reflexión
-        printer.text("*** ANÁLISIS ***\n\n")
-        printer.text("Necesidad...: No detectada\n")
-        printer.text("Exceso.....: Confirmado\n")
-        printer.text("Proceso....: Algorítmico\n")
-        printer.text("Resultado...: No estándar\n\n")
-
-        # 6. Prompt del estilo
-        printer.set(align='center')
-        printer.text("*** PROMPT ***\n\n")
-        printer.text(f"{estilo_info['prompt']}\n\n")
-
-        # 7. Pie de página
-        printer.text("--------------------\n")
-        printer.text("Fin de Transmisión\n")
-
-        # Fecha y hora
-        now = datetime.datetime.now()
-        fecha_hora = now.strftime("%Y-%m-%d %H:%M:%S")
-        printer.text(f"{fecha_hora}\n")
-        
-        # 8. Código QR al final
-        printer.text("\n")
-        printer.text("*** ACCESO ***\n\n")
-        
-        # Pausa para que la impresora procese todo lo anterior
-        time.sleep(2)
-        
-        if not print_qr_code(printer):
-            printer.text("[Error al generar QR]\n")
-
-        # Avance de papel
-        printer.text("\n" * 3)
-
-        print("--- Impresión del ticket finalizada ---")
-        return True
-
-    except Exception as e:
-        print(f"Error durante la impresión del ticket: {str(e)}")
-        return False
-
-def draw_image(screen, image_path):
-    try:
-        # Cargar la imagen
-        img = Image.open(image_path)
-        
-        # NO convertir a escala de grises - mantener color para pantalla
-        # img = img.convert('L')  # Esta línea se elimina
-        
-        # Ajustar tamaño según el tipo de imagen
-        if "suscripcion" in image_path:
-            # Para la imagen de suscripción, usar 95% de la pantalla
-            max_size = min(SCREEN_WIDTH, SCREEN_HEIGHT) * 1.20
-            print(f"Mostrando imagen de suscripción con tamaño aumentado")
-        else:
-            # Para imágenes del botón, usar 80% de la pantalla (como antes)
-            max_size = min(SCREEN_WIDTH, SCREEN_HEIGHT) * 0.8
-        
-        width, height = img.size
-        ratio = max_size / max(width, height)
-        new_width = int(width * ratio)
-        new_height = int(height * ratio)
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Convertir a formato Pygame manteniendo el color
-        img = img.convert('RGB')
-        img_surface = pygame.image.fromstring(img.tobytes(), img.size, 'RGB')
-        
-        # Calcular posición centrada
-        x = (SCREEN_WIDTH - new_width) // 2
-        y = (SCREEN_HEIGHT - new_height) // 2
-        
-        # Dibujar la imagen
-        screen.blit(img_surface, (x, y))
-        return True
-    except Exception as e:
-        print(f"Error al mostrar la imagen: {str(e)}")
-        return False
-
-def move_servo_sequence(servo, start_angle, end_angle, steps=5, delay=0.05):
-    """Realiza una secuencia de movimientos complejos con el servo"""
-    try:
-        # Movimiento inicial suave
-        move_servo_smoothly(servo, end_angle, steps, delay)
-        time.sleep(0.2)
-        
-        # Movimiento rápido de regreso
-        move_servo_smoothly(servo, start_angle, 3, 0.02)
-        time.sleep(0.1)
-        
-        # Movimiento intermedio
-        move_servo_smoothly(servo, (start_angle + end_angle) / 2, 2, 0.03)
-        time.sleep(0.1)
-        
-        # Secuencia de vibración
-        for _ in range(5):
-            servo.angle = end_angle
-            time.sleep(0.05)
-            servo.angle = start_angle
-            time.sleep(0.05)
-        
-        # Posición final
-        servo.angle = start_angle
-        time.sleep(0.1)
-        
-    except Exception as e:
-        print(f"Error en la secuencia del servo: {str(e)}")
-
-# === FUNCIONES PARA QR ===
-
-def generate_qr_image():
-    """Genera una imagen de código QR y la guarda temporalmente"""
-    try:
-        # Crear el código QR
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=QR_SIZE,
-            border=QR_BORDER,
-        )
-        qr.add_data(QR_URL)
-        qr.make(fit=True)
-
-        # Crear la imagen
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Guardar temporalmente
-        qr_path = "temp_qr.png"
-        qr_img.save(qr_path)
-        
-        print(f"Código QR generado para: {QR_URL}")
-        return qr_path
-    except Exception as e:
-        print(f"Error al generar código QR: {str(e)}")
-        return None
-
-def print_qr_code(printer):
-    """Imprime solo el código QR"""
-    try:
-        # Generar el QR
-        qr_path = generate_qr_image()
-        if not qr_path:
-            return False
-            
-        # Procesar e imprimir el QR como imagen
-        img = Image.open(qr_path)
-        
-        # Convertir a escala de grises
-        img = img.convert('L')
-        
-        # Ajustar tamaño para la impresora
-        max_width = 384
-        width, height = img.size
-        if width > max_width:
-            ratio = max_width / width
-            new_height = int(height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Convertir a binario
-        img = img.point(lambda x: 0 if x < 128 else 255, '1')
-        
-        # Imprimir
-        printer.set(align='center')
-        printer.image(img, impl="bitImageColumn")
-        printer.text("\n")
-        
-        # Limpiar archivo temporal
-        if os.path.exists(qr_path):
-            os.remove(qr_path)
-            
-        print("Código QR impreso con éxito")
-        return True
-        
-    except Exception as e:
-        print(f"Error al imprimir código QR: {str(e)}")
-        # Limpiar archivo temporal en caso de error
-        if 'qr_path' in locals() and os.path.exists(qr_path):
-            os.remove(qr_path)
-        return False
+@once
+def ticket_printer():
+    """Tickets del kiosko, con la imagen y el estilo elegidos de las bolsas"""
+    return TicketPrinter(get_raster_cache(), get_random_style, get_random_image)
 
-def print_qr_ticket(printer):
-    """Imprime un ticket que contiene solo el código QR con título"""
-    try:
-        print("\n--- Iniciando impresión del ticket QR ---")
-        
-        # 1. Resetear y configurar inicio
-        printer.set(align='center')
-        
-        # 2. Encabezado simple
-        printer.text("*** TU BOTÓN ***\n")
-        printer.text("--------------------\n")
-        printer.text("Código de Acceso\n\n")
-        printer.text("Con tu plan plus de suscripción\n\n")
-        
-        # 3. Imprimir el código QR
-        if not print_qr_code(printer):
-            printer.text("[Error al generar QR]\n\n")
-        
-        # 4. Pie de página
-        printer.text("--------------------\n")
-        printer.text("Escanea para ver tu botón\n")
-        
-        # Fecha y hora
-        now = datetime.datetime.now()
-        fecha_hora = now.strftime("%Y-%m-%d %H:%M:%S")
-        printer.text(f"{fecha_hora}\n")
-        
-        # Avance de papel
-        printer.text("\n" * 3)
-        
-        print("--- Impresión del ticket QR finalizada ---")
-        return True
-        
-    except Exception as e:
-        print(f"Error durante la impresión del ticket QR: {str(e)}")
-        return False
+def on_library_change(event, entry, screen_size):
+    """Mantiene las cachés al día cuando una imagen entra o sale del catálogo"""
+    if event == "removed":
+        get_display_cache().discard(entry.path)
+        get_raster_cache().discard(entry.path)
+    else:
+        # Queda en la caché de superficies hasta que el próximo arranque la empaquete
+        prewarm_library([entry.path], screen_size, get_display_cache(),
+                        raster_cache=None if SOLO_BOTON else get_raster_cache(), workers=1, pack=False)
 
 # === FUNCIONES PARA ATAJOS DE TECLADO ===
 
-def handle_space_key(current_image, button_visible, hide_time, servo_timer, servo_state, printer, servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2):
+def handle_space_key(sessions):
     """Maneja la tecla SPACE (equivalente al botón GPIO)"""
     # Usar la misma lógica probabilística que el botón físico
-    return handle_probabilistic_button(
-        current_image, button_visible, hide_time, servo_timer, servo_state,
-        printer, servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2
-    )
+    return handle_probabilistic_button(sessions)
 
-def handle_p_key(printer):
+def handle_p_key(print_queue):
     """Maneja la tecla P (Solo impresora)"""
-    if printer:
+    if print_queue:
         print("P presionado - Solo impresora")
         if DEBUG_MODE:
-            print_debug(printer)
+            print_queue.submit("debug")
         else:
-            print_art_ticket(printer)
+            print_queue.submit("art")
     else:
         print("P presionado - Impresora no disponible")
 
-def handle_q_key(printer):
+def handle_q_key(print_queue):
     """Maneja la tecla Q (Solo ticket QR)"""
-    if printer:
+    if print_queue:
         print("Q presionado - Solo ticket QR")
-        print_qr_ticket(printer)
+        print_queue.submit("qr")
     else:
         print("Q presionado - Impresora no disponible")
 
-def handle_l_key(printer):
+def handle_l_key(print_queue):
     """Maneja la tecla L (Ticket largo)"""
-    if printer:
+    if print_queue:
         print("L presionado - Ticket largo")
-        print_art_ticket(printer)
+        print_queue.submit("art")
     else:
         print("L presionado - Impresora no disponible")
 
+def schedule_servo_show(servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2):
+    """Planifica el giro de ambos servos en paralelo y su vuelta a reposo"""
+    # Mover el primer servo normalmente
+    servo_motion.move(servo, turn_position)
+    # Realizar la secuencia compleja con el segundo servo
+    servo_motion.move(servo2, neutral_position2)
+    servo_motion.move(servo2, turn_position2)
+    # Breve pausa para mantener el giro
+    servo_motion.hold(servo, 1.25)
+    servo_motion.hold(servo2, 1)
+    servo_motion.move(servo, neutral_position)
+    servo_motion.move(servo2, neutral_position2)  # Volver a la posición inicial de 30 grados
+    servo_motion.detach(servo)
+    servo_motion.detach(servo2)
+
 def handle_s_key(servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2):
     """Maneja la tecla S (Solo servos)"""
     print("S presionado - Solo servos")
-    # Mover el primer servo normalmente
-    move_servo_smoothly(servo, turn_position)
-    # Realizar la secuencia compleja con el segundo servo
-    move_servo_smoothly(servo2, neutral_position2)
-    move_servo_smoothly(servo2, turn_position2)
-    time.sleep(1)  # Breve pausa para mantener el giro
-    move_servo_smoothly(servo, neutral_position)
-    move_servo_smoothly(servo2, neutral_position2)  # Volver a la posición inicial de 30 grados
-    detach_servo(servo)
-    detach_servo(servo2)
+    schedule_servo_show(servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2)
 
 # === SISTEMA DE PROBABILIDAD ===
 
@@ -617,92 +297,155 @@ def select_random_action():
     else:
         return "ticket_servos"
 
-def handle_probabilistic_button(current_image, button_visible, hide_time, servo_timer, servo_state, printer, servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2):
-    """Maneja el botón con sistema de probabilidad"""
-    current_time = time.time()
+def handle_probabilistic_button(sessions, press=None):
+    """Maneja el botón con sistema de probabilidad
+
+    press es la ButtonPress del botón físico (None desde el teclado).
+    Devuelve 'start' si empieza una sesión, 'queued' si la pulsación queda en
+    cola o 'ignored' si se descarta porque otra sesión ocupa la pantalla.
+    """
+    if press is None:
+        # Desde el teclado: sin número de pulsación, no pasa por ButtonEvents
+        press = ButtonPress(None, time.time())
+    outcome = sessions.accept_press(press)
+    if outcome == "queued":
+        print("Pulsación en cola hasta que la sesión actual deje libre la pantalla")
+    if outcome != "start":
+        return outcome
+
+    # 1. SIEMPRE: Seleccionar y mostrar la imagen
+    image = get_random_image()
     
-    if not button_visible:  # Solo actuar si no hay imagen visible
-        # 1. SIEMPRE: Seleccionar y mostrar la imagen
-        current_image = get_random_image()
-        button_visible = True
-        hide_time = None
-        
-        # 2. Seleccionar acción aleatoria
-        action = select_random_action()
-        print(f"Botón presionado - Acción seleccionada: {action}")
-        
-        if action == "solo_imagen":
-            print("🖼️ Solo imagen en pantalla")
-            # Solo mostrar imagen del botón, después cambiar a suscripción
-            hide_time = current_time + 5  # Mostrar botón por 5 segundos
-            servo_timer = current_time  # Usar servo_timer para el cambio de imagen
-            servo_state = "waiting_suscripcion"  # Nuevo estado para cambio a suscripción
-            
-        elif action == "ticket_qr":
-            print("🎫 Imprimiendo ticket QR")
-            if printer:
-                print_qr_ticket(printer)
-            # Ocultar imagen después de 6 segundos
-            hide_time = current_time + 6
-            servo_timer = None
-            servo_state = "neutral"
-            
-        elif action == "ticket_servos":
-            print("🎫🔧 Imprimiendo ticket largo + activando servos")
-            # Imprimir ticket largo con la imagen seleccionada
-            if printer:
-                if DEBUG_MODE:
-                    print_debug(printer)
-                else:
-                    print_art_ticket(printer, imagen_path=current_image)
+    # 2. Seleccionar acción aleatoria
+    action = select_random_action()
+    print(f"Botón presionado - Acción seleccionada: {action}")
+    if action == "ticket_servos" and SOLO_BOTON:
+        action = "ticket_servos_solo"
+    
+    sessions.start(action, image, press.pressed_at)
+    return outcome
+
+def enter_session_state(session, state, print_queue, servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2):
+    """Acciones al entrar en cada estado de una sesión (ver estados.TRANSITIONS)"""
+    if state == "waiting_suscripcion":
+        # Solo mostrar imagen del botón, después cambiar a suscripción
+        print("🖼️ Solo imagen en pantalla")
+        
+    elif state == "suscripcion":
+        logger.info("Cambiando a imagen de suscripción...")
+        session.image = SUSCRIPCION_PATH
+        
+    elif state == "showing_qr":
+        print("🎫 Imprimiendo ticket QR")
+        if print_queue:
+            print_queue.submit("qr")
             
-            # Activar servos según el modo
-            if SOLO_BOTON:
-                # Ejecutar servos inmediatamente
-                move_servo_smoothly(servo, turn_position)
-                move_servo_smoothly(servo2, neutral_position2)
-                move_servo_smoothly(servo2, turn_position2)
-                time.sleep(1)
-                move_servo_smoothly(servo, neutral_position)
-                move_servo_smoothly(servo2, neutral_position2)
-                detach_servo(servo)
-                detach_servo(servo2)
-                hide_time = current_time + 2
-                servo_timer = None
-                servo_state = "neutral"
+    elif state in ("waiting", "servo_show"):
+        print("🎫🔧 Imprimiendo ticket largo + activando servos")
+        # Imprimir ticket largo con la imagen seleccionada
+        if print_queue:
+            if DEBUG_MODE:
+                print_queue.submit("debug")
             else:
-                # Iniciar temporizador para servos
-                servo_timer = current_time
-                servo_state = "waiting"
-                print("Iniciando temporizador para servo...")
-    
-    return current_image, button_visible, hide_time, servo_timer, servo_state
+                print_queue.submit("art", imagen_path=session.image)
+        
+        if state == "servo_show":
+            # Ejecutar servos inmediatamente (sin bloquear la pantalla)
+            schedule_servo_show(servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2)
+        else:
+            print("Iniciando temporizador para servo...")
+            
+    elif state == "turning":
+        # Mover ambos servos a posición de giro
+        logger.info("Activando servos...")
+        servo_motion.move(servo, turn_position)
+        servo_motion.move(servo2, turn_position)
+        
+    elif state == "returning":
+        # Volver ambos servos a posición neutral
+        logger.info("Devolviendo servos a posición neutral...")
+        servo_motion.move(servo, neutral_position)
+        servo_motion.move(servo2, neutral_position)
+        servo_motion.detach(servo)
+        servo_motion.detach(servo2)
 
 def main():
+    # Logging, señales y limpieza solo al arrancar el kiosko, no al importar
+    setup_logging()
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    atexit.register(cleanup_and_exit)
+    
     # Verificar entorno antes de iniciar
     if not check_environment():
         logger.error("Verificación del entorno falló. Cerrando aplicación.")
         sys.exit(1)
     
     # Variables globales para limpieza
-    global servo, servo2, printer
+    global servo, servo2, printer, print_queue, button_events
     servo = None
     servo2 = None
     printer = None
+    print_queue = None
+    button_events = None
     
     try:
         logger.info("Iniciando configuración de hardware...")
         
+        # Servos, botón, impresora y catálogo se inicializan en paralelo mientras se abre la pantalla
+        startup = Startup(START_TIME)
+        startup.launch("servos", get_servos, required=True)
+        startup.launch("boton", get_button, required=True)
+        if not SOLO_BOTON:
+            startup.launch("impresora", get_printer)
+        # Catálogo de imágenes: lectura y normalización de las nuevas o cambiadas
+        image_catalog = get_image_catalog()
+        startup.launch("catalogo", image_catalog.refresh, required=True, provides=False)
+        
+        # Configurar Pygame en cuanto el servidor gráfico esté listo
+        logger.info("Configurando interfaz gráfica...")
+        screen = startup.run("pantalla", get_screen)
+        clock = pygame.time.Clock()
+        display_cache = get_display_cache()
+        renderer = Renderer(screen, display_cache, WHITE)
+        pending_events = []
+        
+        logger.info("✓ Interfaz gráfica configurada correctamente")
+        
+        startup.result("catalogo")
+        if not len(image_catalog):
+            raise RuntimeError(f"Arranque fallido - ninguna imagen válida en '{IMAGES_DIR}'")
+        logger.info(f"Encontradas {len(image_catalog)} imágenes")
+        
+        # Precargar la biblioteca en segundo plano mientras el kiosko espera
+        display_only = [SUSCRIPCION_PATH] if os.path.exists(SUSCRIPCION_PATH) else []
+        start_prewarm(image_catalog.paths(), screen.get_size(), display_cache,
+                      raster_cache=None if SOLO_BOTON else get_raster_cache(),
+                      display_only=display_only, workers=PREWARM_WORKERS)
+        startup.mark("precarga")
+        # Imágenes nuevas en la carpeta: se preparan al llegar, sin reiniciar
+        image_catalog.subscribe(lambda event, entry: on_library_change(event, entry, screen.get_size()))
+        image_catalog.watch()
+        # Tickets de cada estilo compuestos antes de la primera pulsación
+        if not SOLO_BOTON and TICKET_RENDER == "bitmap":
+            startup.run("maquetacion", prerender_static, provides=False)
+        elif not SOLO_BOTON:
+            startup.run("plantillas", compile_art_templates, provides=False)
+        
         # Configurar servos y botón
-        servo = setup_servo(SERVO_PIN)
-        servo2 = setup_servo(SERVO2_PIN)
-        button = Button(BUTTON_PIN)
+        servo, servo2 = startup.result("servos")
+        button_events = ButtonEvents(startup.result("boton"))
         logger.info("✓ Servos y botón configurados correctamente")
         
         # Configurar impresora solo si SOLO_BOTON es False
         if not SOLO_BOTON:
-            printer = setup_printer()
-            if not printer:
+            printer = startup.result("impresora")
+            if printer:
+                # El hilo de impresión es el único que usa la impresora a partir de aquí
+                print_queue = PrintQueue(printer, ticket_printer().handlers())
+                if not printer.connected:
+                    logger.warning("Impresora no conectada. Se reintentará al imprimir...")
+            else:
                 logger.warning("No se pudo configurar la impresora. Continuando solo con los servos...")
         else:
             logger.info("Modo SOLO_BOTON activado: la impresora está deshabilitada.")
@@ -715,29 +458,17 @@ def main():
         
         # Iniciar en posición neutral
         logger.info("Inicializando servos en posición neutral...")
-        move_servo_smoothly(servo2, neutral_position2)
-        detach_servo(servo2)
-        
-        # Configurar Pygame con delays para evitar problemas de inicialización
-        logger.info("Configurando interfaz gráfica...")
-        time.sleep(2)  # Delay para asegurar que X11 esté listo
-        
-        os.environ['SDL_VIDEODRIVER'] = 'x11'  # Forzar driver X11
-        pygame.init()
-        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.FULLSCREEN)
-        pygame.display.set_caption("Tu Botón")
-        pygame.mouse.set_visible(False)  # Ocultar el cursor del mouse
-        clock = pygame.time.Clock()
-        
-        logger.info("✓ Interfaz gráfica configurada correctamente")
-        
-        button_visible = False
-        current_image = None
-        hide_time = None
-        
-        # Variables para el temporizador
-        servo_timer = None
-        servo_state = "neutral"  # neutral, waiting, turning, returning, waiting_suscripcion
+        servo_motion.move(servo2, neutral_position2)
+        servo_motion.detach(servo2)
+        
+        # Sesiones de visitantes: estados, temporizadores y pulsaciones en cola
+        sessions = SessionMachine(
+            on_enter=lambda session, state: enter_session_state(
+                session, state, print_queue, servo, servo2,
+                neutral_position, turn_position, neutral_position2, turn_position2
+            ),
+            max_queued=PRESS_QUEUE_SIZE,
+        )
         
         # Mostrar información de configuración
         logger.info("=== CONFIGURACIÓN ACTIVA ===")
@@ -746,6 +477,8 @@ def main():
         logger.info(f"Botón Pin: {BUTTON_PIN}")
         logger.info(f"Solo Botón: {SOLO_BOTON}")
         logger.info(f"Debug Mode: {DEBUG_MODE}")
+        logger.info(f"Imagen ESC/POS: {image_impl()}")
+        logger.info(f"Ticket: {TICKET_RENDER}")
         logger.info("=== ATAJOS DE TECLADO DISPONIBLES ===")
         logger.info("SPACE - Equivalente al botón GPIO (sistema de probabilidad)")
         logger.info("P     - Solo impresora (ticket completo)")
@@ -759,15 +492,20 @@ def main():
         logger.info(f"Ticket + servos:  {PROB_TICKET_SERVOS}%")
         logger.info("=====================================")
         
-        logger.info("🚀 Tu Botón iniciado correctamente - Entrando en bucle principal")
+        startup.log_timeline()
+        logger.info(f"🚀 Tu Botón iniciado correctamente en {time.time() - START_TIME:.2f}s - Entrando en bucle principal")
         
         # Bucle principal
         while True:
-            # Manejar eventos de Pygame
-            for event in pygame.event.get():
+            # Manejar eventos de Pygame (incluido el que despertó la espera en reposo)
+            events = pending_events + pygame.event.get()
+            pending_events = []
+            for event in events:
                 if event.type == pygame.QUIT:
                     logger.info("Evento QUIT recibido")
                     cleanup_and_exit()
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    renderer.invalidate()
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
                         logger.info("Tecla ESC presionada - Cerrando aplicación")
@@ -775,22 +513,19 @@ def main():
                     elif event.key == pygame.K_SPACE:
                         # SPACE - Equivalente al botón GPIO
                         logger.info("Tecla SPACE presionada")
-                        current_image, button_visible, hide_time, servo_timer, servo_state = handle_space_key(
-                            current_image, button_visible, hide_time, servo_timer, servo_state,
-                            printer, servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2
-                        )
+                        handle_space_key(sessions)
                     elif event.key == pygame.K_p:
                         # P - Solo impresora
                         logger.info("Tecla P presionada")
-                        handle_p_key(printer)
+                        handle_p_key(print_queue)
                     elif event.key == pygame.K_q:
                         # Q - Solo ticket QR
                         logger.info("Tecla Q presionada")
-                        handle_q_key(printer)
+                        handle_q_key(print_queue)
                     elif event.key == pygame.K_l:
                         # L - Ticket largo
                         logger.info("Tecla L presionada")
-                        handle_l_key(printer)
+                        handle_l_key(print_queue)
                     elif event.key == pygame.K_s:
                         # S - Solo servos
                         logger.info("Tecla S presionada")
@@ -798,62 +533,44 @@ def main():
             
             current_time = time.time()
             
-            # Verificar si el botón físico está presionado
-            if button.is_pressed:
+            # Atender las pulsaciones del botón físico recogidas por interrupción
+            for press in button_events.drain():
                 # Usar sistema de probabilidad para el botón físico
                 logger.info("Botón físico presionado")
-                current_image, button_visible, hide_time, servo_timer, servo_state = handle_probabilistic_button(
-                    current_image, button_visible, hide_time, servo_timer, servo_state,
-                    printer, servo, servo2, neutral_position, turn_position, neutral_position2, turn_position2
-                )
+                outcome = handle_probabilistic_button(sessions, press)
+                button_events.record(press, outcome)
             
-            # Manejar estados del servo y transiciones de imagen
-            if servo_timer is not None:
-                if servo_state == "waiting_suscripcion" and current_time - servo_timer >= 5:
-                    # Cambiar a la imagen de suscripción después de 5 segundos
-                    logger.info("Cambiando a imagen de suscripción...")
-                    current_image = "/home/wintermute/tuboton/suscripcion.jpeg"
-                    hide_time = current_time + 5  # Mostrar suscripción por 10 segundos
-                    servo_timer = None
-                    servo_state = "neutral"
-                elif not SOLO_BOTON and servo_state == "waiting" and current_time - servo_timer >= 4:
-                    # Mover ambos servos a posición de giro
-                    logger.info("Activando servos...")
-                    move_servo_smoothly(servo, turn_position)
-                    move_servo_smoothly(servo2, turn_position)
-                    servo_state = "turning"
-                    servo_timer = current_time
-                elif not SOLO_BOTON and servo_state == "turning" and current_time - servo_timer >= 2:
-                    # Volver ambos servos a posición neutral
-                    logger.info("Devolviendo servos a posición neutral...")
-                    move_servo_smoothly(servo, neutral_position)
-                    move_servo_smoothly(servo2, neutral_position)
-                    detach_servo(servo)
-                    detach_servo(servo2)
-                    servo_state = "returning"
-                    servo_timer = current_time
-                elif not SOLO_BOTON and servo_state == "returning" and current_time - servo_timer >= 0.5:
-                    # Establecer el tiempo para ocultar la imagen (5 segundos después)
-                    hide_time = current_time + 5
-                    servo_timer = None
-                    servo_state = "neutral"
+            # Disparar las transiciones de estado que hayan vencido
+            sessions.run_due(current_time)
             
-            # Verificar si es hora de ocultar la imagen
-            if hide_time and current_time >= hide_time:
-                button_visible = False
-                current_image = None
-                hide_time = None
+            # Si la pantalla quedó libre, atender la siguiente pulsación en cola
+            if not sessions.screen_busy and sessions.pending_presses:
+                press = sessions.pending_presses.popleft()
+                outcome = handle_probabilistic_button(sessions, press)
+                if press.seq is not None:
+                    button_events.record(press, outcome, dequeued=True)
             
-            # Limpiar la pantalla con fondo blanco
-            screen.fill(WHITE)
+            # Avanzar los movimientos de servo planificados
+            servo_motion.update(current_time)
             
-            # Dibujar la imagen solo si es visible
-            if button_visible and current_image:
-                draw_image(screen, current_image)
+            # Redibujar solo si cambió la imagen visible (fondo blanco si no hay ninguna)
+            renderer.show(sessions.current_image)
             
-            # Actualizar la pantalla
-            pygame.display.flip()
-            clock.tick(60)
+            if servo_motion.busy:
+                # Hay movimiento en curso: mantener el ritmo de 60 fps
+                clock.tick(60)
+            else:
+                # Pantalla estática: dormir hasta el próximo evento o temporizador
+                # (las pulsaciones del botón despiertan la espera con BUTTON_EVENT)
+                timeout = sessions.seconds_until_next(time.time())
+                if timeout is None or timeout > IDLE_MAX_WAIT:
+                    timeout = IDLE_MAX_WAIT
+                timeout_ms = int(timeout * 1000)
+                # Con timeout 0 pygame esperaría indefinidamente
+                if timeout_ms > 0:
+                    event = pygame.event.wait(timeout_ms)
+                    if event.type != pygame.NOEVENT:
+                        pending_events.append(event)
 
     except KeyboardInterrupt:
         logger.info("Programa detenido por el usuario (Ctrl+C)")
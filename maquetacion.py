@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import logging
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config import PRINTER_MAX_WIDTH, TICKET_FONT_PATH, TICKET_FONT_SIZE, BUTTON_STYLES
+from raster import Raster
+
+logger = logging.getLogger('tuboton')
+
+# === MAQUETACIÓN DEL TICKET COMO UNA SOLA IMAGEN ===
+# Cada bloque se dibuja en una imagen '1' de PRINTER_MAX_WIDTH puntos con la
+# tinta a 1, que es el formato de Raster: apilar bloques es concatenar filas.
+
+LINE_SPACING = 4  # Puntos entre líneas de texto
+FIELD_GAP = 6     # Puntos entre la etiqueta y el valor de un campo
+
+# Etiquetas de los campos del ticket; todas comparten la columna del valor
+FIELD_LABELS = (
+    "ID_Instancia.:", "Sistema Base.:", "Estética.....:", "Referencia...:", "Estilo.......:",
+    "Mediación....:", "Materialidad.:", "Necesidad...:", "Exceso.....:", "Proceso....:", "Resultado...:",
+)
+
+# Secciones que no cambian de un ticket a otro: (líneas, alineación)
+STATIC_SECTIONS = {
+    "cabecera": (["*** TU BOTÓN ***", "--------------------", "Instancia Generativa Única", ""], "center"),
+    "sin_imagen": ([
+        "[------------------------]",
+        "[     (Aquí iría la      ]",
+        "[   imagen del botón     ]",
+        "[    generado, ~50mm)    ]",
+        "[------------------------]",
+        "",
+    ], "center"),
+    "diseno": (["*** DISEÑO ***", ""], "center"),
+    "atributos": (["", "--- Atributos ---"], "left"),
+    "analisis": (["*** ANÁLISIS ***", ""], "left"),
+    "pie": (["--------------------", "Fin de Transmisión"], "center"),
+    "acceso": (["", "*** ACCESO ***", ""], "center"),
+    "linea": ([""], "center"),
+}
+
+# Campos que tampoco cambian
+STATIC_FIELDS = {
+    "campos_materia": [("Mediación....:", "Maquínica"), ("Materialidad.:", "Tinta/Papel APLI 13323")],
+    "campos_analisis": [
+        ("Necesidad...:", "No detectada"),
+        ("Exceso.....:", "Confirmado"),
+        ("Proceso....:", "Algorítmico"),
+        ("Resultado...:", "No estándar"),
+    ],
+}
+
+@lru_cache(maxsize=None)
+def ticket_font(path=TICKET_FONT_PATH, size=TICKET_FONT_SIZE):
+    """Fuente del ticket: TICKET_FONT_PATH o, si no existe, la que trae Pillow"""
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError as e:
+            logger.warning(f"No se pudo cargar la fuente {path}, usando la de Pillow: {str(e)}")
+    return ImageFont.load_default(size)
+
+def line_height(font):
+    ascent, descent = font.getmetrics()
+    return ascent + descent + LINE_SPACING
+
+def wrap(text, font, width):
+    """Parte el texto en líneas que caben en width puntos, por palabras"""
+    lines = []
+    current = ""
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if font.getlength(candidate) <= width:
+            current = candidate
+            continue
+        if current:
+            lines.append(current)
+        # Una palabra más ancha que la línea se corta por caracteres
+        while font.getlength(word) > width and len(word) > 1:
+            cut = len(word) - 1
+            while cut > 1 and font.getlength(word[:cut]) > width:
+                cut -= 1
+            lines.append(word[:cut])
+            word = word[cut:]
+        current = word
+    lines.append(current)
+    return lines
+
+def _canvas(lines_count, font):
+    img = Image.new('1', (PRINTER_MAX_WIDTH, lines_count * line_height(font)), 0)
+    draw = ImageDraw.Draw(img)
+    draw.fontmode = "1"  # Sin suavizado: la impresora solo tiene puntos o nada
+    return img, draw
+
+def text_block(lines, align="center", font=None):
+    """Bloque de texto; una cadena vacía deja una línea en blanco"""
+    font = font or ticket_font()
+    wrapped = [part for line in lines for part in wrap(line, font, PRINTER_MAX_WIDTH)]
+    img, draw = _canvas(len(wrapped), font)
+    for i, line in enumerate(wrapped):
+        x = 0
+        if align == "center":
+            x = (PRINTER_MAX_WIDTH - font.getlength(line)) // 2
+        draw.text((x, i * line_height(font)), line, font=font, fill=1)
+    return Raster.from_image(img)
+
+@lru_cache(maxsize=None)
+def value_column(font=None):
+    """Posición horizontal donde empiezan los valores de los campos"""
+    font = font or ticket_font()
+    return int(max(font.getlength(label) for label in FIELD_LABELS)) + FIELD_GAP
+
+def fields_block(pairs, font=None):
+    """Campos 'etiqueta: valor' con los valores alineados en una misma columna"""
+    font = font or ticket_font()
+    column = value_column(font)
+    rows = []
+    for label, value in pairs:
+        values = wrap(str(value), font, PRINTER_MAX_WIDTH - column)
+        rows.append((label, values[0]))
+        rows.extend(("", extra) for extra in values[1:])
+    img, draw = _canvas(len(rows), font)
+    for i, (label, value) in enumerate(rows):
+        y = i * line_height(font)
+        draw.text((0, y), label, font=font, fill=1)
+        draw.text((column, y), value, font=font, fill=1)
+    return Raster.from_image(img)
+
+def centered(raster):
+    """Raster más estrecho que el papel, centrado en PRINTER_MAX_WIDTH puntos"""
+    if raster.width == PRINTER_MAX_WIDTH:
+        return raster
+    img = Image.new('1', (PRINTER_MAX_WIDTH, raster.height), 0)
+    img.paste(raster.to_image(), ((PRINTER_MAX_WIDTH - raster.width) // 2, 0))
+    return Raster.from_image(img)
+
+def stack(rasters):
+    """Apila rasters del ancho del papel uno debajo de otro"""
+    return Raster(PRINTER_MAX_WIDTH, sum(r.height for r in rasters), b"".join(r.rows for r in rasters))
+
+@lru_cache(maxsize=None)
+def static_section(name):
+    """Sección fija del ticket, dibujada una sola vez"""
+    if name in STATIC_FIELDS:
+        return fields_block(STATIC_FIELDS[name])
+    lines, align = STATIC_SECTIONS[name]
+    return text_block(lines, align)
+
+@lru_cache(maxsize=64)
+def style_section(estilo_base, desc, ref, style_text, prompt):
+    """Todo lo que va del ID de instancia a la fecha: solo depende del estilo
+
+    Con los 12 estilos de BUTTON_STYLES cabe entero en caché; el texto ya
+    va partido en líneas y dibujado.
+    """
+    return stack([
+        fields_block([("Sistema Base.:", estilo_base)]),
+        static_section("atributos"),
+        fields_block([("Estética.....:", desc), ("Referencia...:", ref), ("Estilo.......:", style_text)]),
+        static_section("campos_materia"),
+        static_section("linea"),
+        static_section("analisis"),
+        static_section("campos_analisis"),
+        static_section("linea"),
+        text_block(["*** PROMPT ***", "", prompt, ""], "center"),
+        static_section("pie"),
+    ])
+
+@lru_cache(maxsize=4)
+def qr_section(qr):
+    """Título de acceso y QR centrado"""
+    return stack([static_section("acceso"), centered(qr), static_section("linea")])
+
+def prerender_static():
+    """Dibuja por adelantado las secciones fijas y las de cada estilo"""
+    for name in list(STATIC_SECTIONS) + list(STATIC_FIELDS):
+        static_section(name)
+    for estilo_base, estilo_info in BUTTON_STYLES.items():
+        style_section(estilo_base, estilo_info['desc'], estilo_info['ref'], estilo_info['style_text'], estilo_info['prompt'])
+
+def art_ticket_raster(estilo_base, estilo_info, id_instancia, fecha_hora, image_raster=None, qr=None):
+    """Ticket artístico completo como un único raster de PRINTER_MAX_WIDTH puntos
+
+    Solo se dibujan el ID y la fecha; el resto son secciones ya dibujadas
+    (fijas o del estilo), la imagen y el QR ya convertidos a raster.
+    """
+    blocks = [static_section("cabecera")]
+    if image_raster is not None:
+        blocks += [centered(image_raster), static_section("linea")]
+    else:
+        blocks.append(static_section("sin_imagen"))
+    blocks += [
+        static_section("diseno"),
+        fields_block([("ID_Instancia.:", id_instancia)]),
+        style_section(estilo_base, estilo_info['desc'], estilo_info['ref'], estilo_info['style_text'], estilo_info['prompt']),
+        text_block([fecha_hora], "center"),
+    ]
+    if qr is not None:
+        blocks.append(qr_section(qr))
+    return stack(blocks)
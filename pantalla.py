@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+import pygame
+from PIL import Image
+
+logger = logging.getLogger('tuboton')
+
+# === SUPERFICIES DE PANTALLA ===
+
+def display_max_size(image_path, screen_size):
+    """Calcula el lado máximo en pantalla según el tipo de imagen"""
+    screen_width, screen_height = screen_size
+    if "suscripcion" in image_path:
+        # Para la imagen de suscripción, usar el 120% del lado menor
+        return min(screen_width, screen_height) * 1.20
+    # Para imágenes del botón, usar 80% de la pantalla
+    return min(screen_width, screen_height) * 0.8
+
+def display_image(image_path, screen_size, open_image=Image.open):
+    """Carga una imagen y la escala para la pantalla, en RGB
+
+    Un JPEG mucho más grande que la pantalla (p. ej. la suscripción) se
+    decodifica ya reducido (modo draft de Pillow: 1/2, 1/4 u 1/8) y solo
+    se afina el tamaño final con LANCZOS.
+    """
+    img = open_image(image_path)
+
+    max_size = display_max_size(image_path, screen_size)
+    width, height = img.size
+    ratio = max_size / max(width, height)
+    new_width = int(width * ratio)
+    new_height = int(height * ratio)
+    # Solo hace algo con JPEG aún sin decodificar y nunca por debajo del tamaño pedido
+    img.draft('RGB', (new_width, new_height))
+    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+    return img.convert('RGB')
+
+def build_display_surface(image_path, screen_size, open_image=Image.open):
+    """Carga una imagen, la escala para la pantalla y la convierte a superficie de Pygame"""
+    img = display_image(image_path, screen_size, open_image)
+    # Convertir a formato Pygame manteniendo el color
+    return pygame.image.fromstring(img.tobytes(), img.size, 'RGB')
+
+# === FOTOGRAMAS EMPAQUETADOS EN UN FICHERO MAPEADO EN MEMORIA ===
+
+Frame = namedtuple('Frame', ['offset', 'size', 'width', 'height', 'mtime'])
+
+class FrameStore:
+    """Todas las imágenes de la biblioteca ya escaladas, en un único fichero por resolución
+
+    El fichero empieza con un índice (ruta, mtime de la fuente, posición,
+    tamaño y dimensiones de cada fotograma) seguido de los píxeles RGB, cada
+    fotograma alineado a página. Se abre con mmap y get() crea la superficie
+    con pygame.image.frombuffer directamente sobre el mapeo, sin copiar: es
+    la caché de páginas del sistema la que decide qué queda en memoria.
+    """
+
+    MAGIC = b"TBF1"
+    HEADER = struct.Struct('<4sHHI')
+    ENTRY = struct.Struct('<QIHHqH')
+
+    def __init__(self, frames_dir):
+        self.frames_dir = frames_dir
+        self._screen_size = None
+        self._index = {}
+        self._map = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _pack_path(self, screen_size):
+        return os.path.join(self.frames_dir, f"pantalla-{screen_size[0]}x{screen_size[1]}.frames")
+
+    def _read(self, pack_path, screen_size):
+        """Mapea un fichero de fotogramas y lee su índice; ({}, None) si no existe o no vale"""
+        try:
+            with open(pack_path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return {}, None
+        try:
+            magic, width, height, count = self.HEADER.unpack_from(mapping)
+            if magic != self.MAGIC or (width, height) != tuple(screen_size):
+                mapping.close()
+                return {}, None
+            index = {}
+            position = self.HEADER.size
+            for _ in range(count):
+                offset, size, frame_width, frame_height, mtime, path_length = self.ENTRY.unpack_from(mapping, position)
+                position += self.ENTRY.size
+                image_path = mapping[position:position + path_length].decode()
+                position += path_length
+                if offset + size > len(mapping):
+                    raise ValueError(f"fotograma fuera del fichero: {image_path}")
+                index[image_path] = Frame(offset, size, frame_width, frame_height, mtime)
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            logger.warning(f"Fichero de fotogramas corrupto {pack_path}, se regenera: {str(e)}")
+            mapping.close()
+            return {}, None
+        return index, mapping
+
+    def _current(self, screen_size):
+        """Índice y mapeo del fichero de screen_size, adoptándolo si aún no lo estaba"""
+        with self._lock:
+            if tuple(screen_size) == self._screen_size:
+                return self._index, self._map
+        index, mapping = self._read(self._pack_path(screen_size), screen_size)
+        self._adopt(screen_size, index, mapping)
+        return index, mapping
+
+    @staticmethod
+    def _sources(image_paths):
+        sources = {}
+        for image_path in image_paths:
+            try:
+                sources[image_path] = os.stat(image_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return sources
+
+    def missing(self, image_paths, screen_size):
+        """Rutas de image_paths que no tienen fotograma al día para screen_size"""
+        index, _ = self._current(screen_size)
+        return [
+            image_path for image_path, mtime in self._sources(image_paths).items()
+            if image_path not in index or index[image_path].mtime != mtime
+        ]
+
+    def update(self, image_paths, screen_size, scaled=()):
+        """Reescribe el fichero de screen_size con image_paths; no escala nada
+
+        Los fotogramas al día se copian del fichero actual. scaled da pares
+        (ruta, imagen ya escalada o None si falló) para las que devolvió
+        missing(); cada uno se escribe según llega, así que puede ser el
+        resultado del pool de la precarga sin acumular imágenes en memoria.
+        """
+        pack_path = self._pack_path(screen_size)
+        index, mapping = self._current(screen_size)
+        sources = self._sources(image_paths)
+
+        reused = {path for path, mtime in sources.items() if path in index and index[path].mtime == mtime}
+        if len(reused) == len(sources) == len(index):
+            return 0
+
+        os.makedirs(self.frames_dir, exist_ok=True)
+        names = {image_path: image_path.encode() for image_path in sources}
+        index_size = self.HEADER.size + sum(self.ENTRY.size + len(name) for name in names.values())
+        position = -(-index_size // mmap.PAGESIZE) * mmap.PAGESIZE
+        frames = {}
+        tmp_path = f"{pack_path}.{threading.get_ident()}.tmp"
+
+        def write_frame(f, image_path, pixels, width, height):
+            nonlocal position
+            f.seek(position)
+            f.write(pixels)
+            frames[image_path] = Frame(position, len(pixels), width, height, sources[image_path])
+            position = -(-(position + len(pixels)) // mmap.PAGESIZE) * mmap.PAGESIZE
+
+        with open(tmp_path, 'wb') as f:
+            for image_path in reused:
+                old = index[image_path]
+                write_frame(f, image_path, mapping[old.offset:old.offset + old.size], old.width, old.height)
+            for image_path, img in scaled:
+                if img is None or image_path not in sources or image_path in frames:
+                    continue
+                write_frame(f, image_path, img.tobytes(), img.width, img.height)
+
+            f.seek(0)
+            f.write(self.HEADER.pack(self.MAGIC, screen_size[0], screen_size[1], len(frames)))
+            for image_path, frame in frames.items():
+                name = names[image_path]
+                f.write(self.ENTRY.pack(frame.offset, frame.size, frame.width, frame.height, frame.mtime, len(name)))
+                f.write(name)
+        os.replace(tmp_path, pack_path)
+
+        index, mapping = self._read(pack_path, screen_size)
+        self._adopt(screen_size, index, mapping)
+        new_frames = len(frames) - len(reused)
+        logger.info(f"Fotogramas de pantalla: {len(frames)} en {pack_path} ({new_frames} escalados de nuevo)")
+        return new_frames
+
+    def _adopt(self, screen_size, index, mapping):
+        # El mapeo anterior se libera solo cuando ya no lo usa ninguna superficie
+        with self._lock:
+            self._screen_size = tuple(screen_size)
+            self._index = index
+            self._map = mapping
+
+    def get(self, image_path, screen_size):
+        """Superficie sobre el mapeo, o None si la imagen no está empaquetada o ha cambiado"""
+        with self._lock:
+            if tuple(screen_size) != self._screen_size:
+                return None
+            frame = self._index.get(image_path)
+            mapping = self._map
+        if frame is None:
+            return None
+        try:
+            if os.stat(image_path).st_mtime_ns != frame.mtime:
+                return None
+        except FileNotFoundError:
+            return None
+        pixels = memoryview(mapping)[frame.offset:frame.offset + frame.size]
+        return pygame.image.frombuffer(pixels, (frame.width, frame.height), 'RGB')
+
+class SurfaceCache:
+    """Caché LRU de superficies ya escaladas, por ruta y tamaño de pantalla
+
+    open_image abre la imagen original (p. ej. ImageStore.open, ya decodificada).
+    Con frames, las imágenes empaquetadas se sirven desde el FrameStore y no
+    ocupan sitio en la caché; el resto (la suscripción, imágenes recién
+    llegadas) se escalan y guardan aquí como siempre.
+    """
+
+    def __init__(self, max_items, open_image=Image.open, frames=None):
+        self.max_items = max_items
+        self.open_image = open_image
+        self.frames = frames
+        self._surfaces = OrderedDict()
+        # La precarga rellena la caché desde hilos de trabajo
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def __contains__(self, key):
+        return key in self._surfaces
+
+    def get(self, image_path, screen_size):
+        """Devuelve la superficie escalada, construyéndola solo la primera vez"""
+        if self.frames is not None:
+            surface = self.frames.get(image_path, screen_size)
+            if surface is not None:
+                return surface
+
+        key = (image_path, tuple(screen_size))
+        with self._lock:
+            surface = self._surfaces.get(key)
+            if surface is not None:
+                self._surfaces.move_to_end(key)
+                return surface
+
+        # Construir fuera del candado para no bloquear la pantalla
+        surface = build_display_surface(image_path, screen_size, self.open_image)
+        with self._lock:
+            self._surfaces[key] = surface
+            # Expulsar las superficies menos usadas recientemente
+            while len(self._surfaces) > self.max_items:
+                self._surfaces.popitem(last=False)
+        logger.debug(f"Superficie cacheada: {image_path} ({len(self._surfaces)}/{self.max_items})")
+        return surface
+
+    def _frame_image(self, image_path, screen_size):
+        try:
+            return image_path, display_image(image_path, screen_size, self.open_image)
+        except Exception as e:
+            logger.error(f"Error al empaquetar {image_path}: {str(e)}")
+            return image_path, None
+
+    def pack(self, image_paths, screen_size, map_func=map):
+        """Empaqueta image_paths en el FrameStore (si lo hay) para servirlas desde allí
+
+        Las que faltan se escalan con map_func (p. ej. executor.map del pool de
+        la precarga); el FrameStore solo escribe el fichero.
+        """
+        if self.frames is None:
+            return
+        try:
+            missing = self.frames.missing(image_paths, screen_size)
+            scaled = map_func(lambda image_path: self._frame_image(image_path, screen_size), missing)
+            self.frames.update(image_paths, screen_size, scaled)
+        except OSError as e:
+            logger.warning(f"Fotogramas de pantalla no disponibles: {str(e)}")
+            return
+        # Lo que ya está empaquetado no necesita seguir en la caché
+        packed = set(image_paths)
+        with self._lock:
+            for key in [key for key in self._surfaces if key[0] in packed]:
+                del self._surfaces[key]
+
+    def discard(self, image_path):
+        """Olvida las superficies de una imagen (borrada o cambiada), para cualquier tamaño"""
+        with self._lock:
+            for key in [key for key in self._surfaces if key[0] == image_path]:
+                del self._surfaces[key]
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._surfaces.clear()
+
+# === RENDERIZADO ===
+
+class Renderer:
+    """Redibuja solo cuando cambia la imagen visible y actualiza solo las zonas afectadas"""
+
+    def __init__(self, screen, surface_cache, background):
+        self.screen = screen
+        self.surface_cache = surface_cache
+        self.background = background
+        self._shown = None
+        self._rect = None
+        self._full_redraw = True
+
+    def invalidate(self):
+        """Fuerza un redibujado completo (p. ej. tras exponerse la ventana)"""
+        self._full_redraw = True
+
+    def show(self, image_path):
+        """Muestra image_path (o nada si es None); devuelve True si hubo que redibujar"""
+        if image_path == self._shown and not self._full_redraw:
+            return False
+
+        dirty = []
+        if self._full_redraw:
+            self.screen.fill(self.background)
+        elif self._rect:
+            # Borrar solo la zona que ocupaba la imagen anterior
+            dirty.append(self.screen.fill(self.background, self._rect))
+
+        self._rect = None
+        if image_path:
+            try:
+                surface = self.surface_cache.get(image_path, self.screen.get_size())
+                screen_width, screen_height = self.screen.get_size()
+                x = (screen_width - surface.get_width()) // 2
+                y = (screen_height - surface.get_height()) // 2
+                self._rect = self.screen.blit(surface, (x, y))
+                dirty.append(self._rect)
+            except Exception as e:
+                logger.error(f"Error al mostrar la imagen: {str(e)}")
+
+        if self._full_redraw:
+            pygame.display.flip()
+            self._full_redraw = False
+        else:
+            pygame.display.update(dirty)
+        self._shown = image_path
+        return True
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import qrcode
+from PIL import Image, ImageStat
+
+from config import PRINTER_MAX_WIDTH, THERMAL_CONTRAST, THERMAL_BRIGHTNESS, THERMAL_THRESHOLD, THERMAL_DITHER
+
+logger = logging.getLogger('tuboton')
+
+ESC = b'\x1b'
+GS = b'\x1d'
+
+# === RASTER PARA LA IMPRESORA TÉRMICA ===
+
+class Raster(namedtuple('Raster', ['width', 'height', 'rows'])):
+    """Bitmap 1-bit en filas empaquetadas, con bit a 1 = punto impreso (formato ESC/POS)"""
+
+    __slots__ = ()
+
+    @property
+    def width_bytes(self):
+        return (self.width + 7) >> 3
+
+    @classmethod
+    def from_image(cls, img):
+        """Crea el raster a partir de una imagen '1' donde blanco = punto impreso"""
+        return cls(img.width, img.height, img.tobytes())
+
+    def to_image(self):
+        """Imagen '1' con los puntos impresos en blanco, como la usa python-escpos"""
+        return Image.frombytes('1', (self.width, self.height), self.rows)
+
+def thermal_params(dither=THERMAL_DITHER):
+    """Parámetros de los que depende el raster térmico (cambian la clave de caché)"""
+    return {
+        "max_width": PRINTER_MAX_WIDTH,
+        "contrast": THERMAL_CONTRAST,
+        "brightness": THERMAL_BRIGHTNESS,
+        "threshold": THERMAL_THRESHOLD,
+        "dither": dither,
+    }
+
+# Modos de binarización disponibles para THERMAL_DITHER
+DITHER_MODES = ("threshold", "floyd-steinberg", "bayer")
+
+# Matriz de Bayer 8x8 escalada a umbrales de 0-255
+_BAYER_8X8 = np.array([
+    [0, 32, 8, 40, 2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44, 4, 36, 14, 46, 6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [3, 35, 11, 43, 1, 33, 9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47, 7, 39, 13, 45, 5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+], dtype=np.uint8) * 4 + 2
+
+def threshold_lut(threshold):
+    """Tabla de 256 entradas que binariza en un único paso de Image.point"""
+    return [0] * threshold + [255] * (256 - threshold)
+
+def tone_lut(img):
+    """Tabla de 256 entradas equivalente a Contrast + Brightness de PIL sobre esta imagen
+
+    El contraste depende de la media de la imagen, así que la tabla se obtiene
+    aplicando las mismas mezclas de PIL a una rampa de 256 valores.
+    """
+    mean = int(ImageStat.Stat(img).mean[0] + 0.5)
+    ramp = Image.frombytes('L', (256, 1), bytes(range(256)))
+    ramp = Image.blend(Image.new('L', ramp.size, mean), ramp, THERMAL_CONTRAST)
+    ramp = Image.blend(Image.new('L', ramp.size, 0), ramp, THERMAL_BRIGHTNESS)
+    return list(ramp.tobytes())
+
+def thermal_raster(image_path, dither=THERMAL_DITHER, open_image=Image.open):
+    """Convierte una imagen en el raster 1-bit listo para la impresora térmica
+
+    Contraste, brillo y binarización se fusionan en una sola tabla, así que la
+    imagen en grises se recorre una única vez. La imagen del ticket va
+    invertida: se imprimen los píxeles claros (bit a 1).
+    """
+    img = open_image(image_path)
+
+    # Convertir a escala de grises (L)
+    img = img.convert('L')
+
+    # Ajustar tamaño
+    width, height = img.size
+    if width > PRINTER_MAX_WIDTH:
+        ratio = PRINTER_MAX_WIDTH / width
+        new_height = int(height * ratio)
+        img = img.resize((PRINTER_MAX_WIDTH, new_height), Image.Resampling.LANCZOS)
+
+    tone = tone_lut(img)
+
+    if dither == "threshold":
+        # Umbral bajo para obtener más píxeles negros, en el mismo paso que el tono
+        lut = [255 if value >= THERMAL_THRESHOLD else 0 for value in tone]
+        return Raster.from_image(img.point(lut, '1'))
+
+    img = img.point(tone)
+
+    if dither == "floyd-steinberg":
+        return Raster.from_image(img.convert('1', dither=Image.Dither.FLOYDSTEINBERG))
+
+    if dither == "bayer":
+        pixels = np.asarray(img)
+        rows, cols = pixels.shape
+        thresholds = np.tile(_BAYER_8X8, (rows // 8 + 1, cols // 8 + 1))[:rows, :cols]
+        bits = np.packbits(pixels >= thresholds, axis=1)
+        return Raster(cols, rows, bits.tobytes())
+
+    raise ValueError(f"Modo de binarización desconocido: {dither}")
+
+@lru_cache(maxsize=8)
+def qr_raster(url, box_size, border):
+    """Raster de un código QR, generado una sola vez por URL, tamaño y borde"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white").get_image().convert('L')
+
+    # Ajustar tamaño para la impresora
+    width, height = img.size
+    if width > PRINTER_MAX_WIDTH:
+        ratio = PRINTER_MAX_WIDTH / width
+        img = img.resize((PRINTER_MAX_WIDTH, int(height * ratio)), Image.Resampling.LANCZOS)
+
+    # Se imprimen los módulos oscuros (bit a 1)
+    return Raster.from_image(img.point([255 - v for v in threshold_lut(128)], '1'))
+
+# === CODIFICACIÓN ESC/POS ===
+
+def _low_high(number, length):
+    """Entero en bytes little-endian, como espera ESC/POS"""
+    return number.to_bytes(length, 'little')
+
+def _band(raster, top, height):
+    """Filas [top, top + height) del raster como un raster propio, rellenando con blanco al final"""
+    row_bytes = raster.width_bytes
+    rows = raster.rows[top * row_bytes:(top + height) * row_bytes]
+    missing = height * row_bytes - len(rows)
+    if missing:
+        rows += bytes(missing)
+    return Raster(raster.width, height, rows)
+
+def encode_bands(raster, impl="bitImageColumn", band_height=None):
+    """Genera el comando de imagen ESC/POS banda a banda, sin codificar la imagen entera de golpe
+
+    bitImageColumn va siempre en franjas de 24 líneas, que es lo que abarca
+    cada ESC *. GS v 0 y GS ( L se parten en bandas de band_height líneas,
+    cada una con su propia cabecera; sin band_height sale una sola banda.
+    Unidas, las bandas son exactamente encode_raster().
+    """
+    if impl == "bitImageColumn":
+        # ESC *, imagen en columnas de 24 puntos
+        header = ESC + b"*" + b"\x21" + _low_high(raster.width, 2)
+        yield ESC + b"3" + b"\x10"  # Ajustar el avance de línea
+        for top in range(0, raster.height, 24):
+            im_slice = _band(raster, top, 24).to_image().transpose(Image.ROTATE_270).transpose(Image.FLIP_LEFT_RIGHT)
+            yield header + im_slice.tobytes() + b"\n"
+        yield ESC + b"2"  # Restaurar el avance de línea
+        return
+
+    if impl not in ("bitImageRaster", "graphics"):
+        raise ValueError(f"Implementación de imagen desconocida: {impl}")
+
+    band_height = band_height or raster.height
+    for top in range(0, raster.height, band_height):
+        height = min(band_height, raster.height - top)
+        rows = raster.rows[top * raster.width_bytes:(top + height) * raster.width_bytes]
+        if impl == "bitImageRaster":
+            # GS v 0, imagen en formato raster
+            yield GS + b"v0" + b"\x00" + _low_high(raster.width_bytes, 2) + _low_high(height, 2) + rows
+        else:
+            # GS ( L, gráficos en formato raster
+            header = b"0" + b"\x01" + b"\x01" + b"1" + _low_high(raster.width, 2) + _low_high(height, 2)
+            data = b"0p" + header + rows
+            yield GS + b"(L" + _low_high(len(data), 2) + data
+            yield GS + b"(L" + _low_high(2, 2) + b"02"
+
+def encode_raster(raster, impl="bitImageColumn"):
+    """Codifica el raster con el comando de imagen ESC/POS indicado
+
+    Produce los mismos bytes que printer.image() de python-escpos en alta densidad.
+    """
+    return b"".join(encode_bands(raster, impl))
+
+# === CACHÉ DE RASTERS ===
+
+class RasterDiskCache:
+    """Caché persistente de rasters, indexada por hash del contenido y parámetros
+
+    Cada entrada es un fichero con una cabecera (ancho, alto) seguida de las filas
+    empaquetadas. El índice guarda el mtime de cada fuente para no volver a
+    calcular su hash mientras el fichero no cambie. Las entradas de imágenes
+    borradas o cambiadas se eliminan, así que la caché no crece sin límite.
+    """
+
+    MAGIC = b"TBR1"
+    HEADER = struct.Struct('<4sHH')
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.Lock()
+        self._params_key = hashlib.sha1(
+            json.dumps(thermal_params(), sort_keys=True).encode()
+        ).hexdigest()[:12]
+        self._index = self._load_index()
+        self._prune_stale()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _prune_stale(self):
+        """Borra las entradas de otros parámetros de procesado y las de imágenes que ya no existen"""
+        missing = [image_path for image_path in self._index if not os.path.exists(image_path)]
+        for image_path in missing:
+            del self._index[image_path]
+        if missing:
+            self._save_index()
+
+        hashes = {entry["hash"] for entry in self._index.values()}
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".raster"):
+                continue
+            content_hash, _, params = name[:-len(".raster")].partition("-")
+            if params != self._params_key or content_hash not in hashes:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def _remove_entry(self, content_hash):
+        """Borra el raster de un hash si ninguna imagen del índice lo usa ya (con el candado tomado)"""
+        if any(entry["hash"] == content_hash for entry in self._index.values()):
+            return
+        try:
+            os.remove(os.path.join(self.cache_dir, f"{content_hash}-{self._params_key}.raster"))
+        except FileNotFoundError:
+            pass
+
+    def forget(self, image_path):
+        """Quita una imagen borrada o cambiada del índice y su raster de disco"""
+        with self._lock:
+            entry = self._index.pop(image_path, None)
+            if entry is None:
+                return
+            self._save_index()
+            self._remove_entry(entry["hash"])
+
+    def _content_hash(self, image_path):
+        """Hash del contenido, recalculado solo si cambia el mtime del fichero"""
+        mtime = os.stat(image_path).st_mtime_ns
+        with self._lock:
+            entry = self._index.get(image_path)
+        if entry and entry["mtime"] == mtime:
+            return entry["hash"]
+
+        with open(image_path, 'rb') as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()
+        with self._lock:
+            self._index[image_path] = {"mtime": mtime, "hash": content_hash}
+            self._save_index()
+            # El raster de la versión anterior ya no sirve a nadie
+            if entry and entry["hash"] != content_hash:
+                self._remove_entry(entry["hash"])
+        return content_hash
+
+    def _entry_path(self, image_path):
+        return os.path.join(self.cache_dir, f"{self._content_hash(image_path)}-{self._params_key}.raster")
+
+    def load(self, image_path):
+        """Lee el raster de disco, o None si no está o no es válido"""
+        try:
+            with open(self._entry_path(image_path), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(data) < self.HEADER.size:
+            logger.warning(f"Entrada de caché corrupta para {image_path}, se regenera")
+            return None
+        magic, width, height = self.HEADER.unpack_from(data)
+        rows = data[self.HEADER.size:]
+        if magic != self.MAGIC or len(rows) != ((width + 7) >> 3) * height:
+            logger.warning(f"Entrada de caché corrupta para {image_path}, se regenera")
+            return None
+        return Raster(width, height, rows)
+
+    def store(self, image_path, raster):
+        """Guarda el raster en disco de forma atómica"""
+        entry_path = self._entry_path(image_path)
+        tmp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, raster.width, raster.height))
+            f.write(raster.rows)
+        os.replace(tmp_path, entry_path)
+
+class RasterCache:
+    """Caché en memoria de rasters para la impresora, respaldada opcionalmente en disco"""
+
+    def __init__(self, disk_cache=None, open_image=Image.open):
+        self.disk_cache = disk_cache
+        self.open_image = open_image
+        self._rasters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rasters)
+
+    def __contains__(self, image_path):
+        return image_path in self._rasters
+
+    def get(self, image_path):
+        """Devuelve el raster de la imagen, procesándola solo si no está en caché"""
+        with self._lock:
+            raster = self._rasters.get(image_path)
+        if raster is not None:
+            return raster
+
+        if self.disk_cache is not None:
+            raster = self.disk_cache.load(image_path)
+        if raster is None:
+            raster = thermal_raster(image_path, open_image=self.open_image)
+            if self.disk_cache is not None:
+                self.disk_cache.store(image_path, raster)
+
+        with self._lock:
+            self._rasters[image_path] = raster
+        return raster
+
+    def discard(self, image_path):
+        """Olvida el raster de una imagen borrada o cambiada, en memoria y en disco"""
+        with self._lock:
+            self._rasters.pop(image_path, None)
+        if self.disk_cache is not None:
+            self.disk_cache.forget(image_path)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import random
+import threading
+from collections import Counter, deque
+
+logger = logging.getLogger('tuboton')
+
+# === SELECCIÓN SIN REPETICIONES ===
+
+class ShuffleBag:
+    """Bolsa barajada: cada elemento sale tantas veces por ronda como su peso
+
+    Cada ronda mete en la bolsa los elementos repetidos según su peso entero
+    (0 lo excluye), la baraja y los va sacando en orden, así que sacar uno
+    es O(1) y a la larga cada elemento sale en proporción a su peso. Además,
+    ninguno se repite dentro de las últimas no_repeat extracciones: si toca
+    uno reciente se intercambia con otro de más adelante en la bolsa y, si
+    ya no queda ninguno en la ronda, lo que falta pasa a la siguiente. Si un
+    peso no cabe en la ventana, manda la ventana.
+
+    Con state_path, la bolsa entera (con la posición y las últimas
+    extracciones) solo se guarda cuando cambia: al empezar ronda o al añadir
+    un elemento. Tras cada extracción basta con anotar la ronda y la
+    posición en un fichero aparte de pocos bytes; al reiniciar se rehacen en
+    memoria las extracciones que van desde la bolsa guardada hasta esa
+    posición. Los intercambios usan un generador derivado de (clave, ronda,
+    posición), así que rehacerlos da lo mismo que la primera vez. Con seed,
+    cada ronda se baraja con una semilla derivada de (seed, ronda): la
+    secuencia es reproducible, con o sin reinicios por medio.
+    """
+
+    # Posiciones que se prueban para sustituir un elemento repetido
+    SWAP_TRIES = 8
+
+    def __init__(self, weights, no_repeat=0, seed=None, state_path=None):
+        self.weights = {item: int(weight) for item, weight in weights.items() if weight > 0}
+        self.no_repeat = no_repeat
+        self.seed = seed
+        self.state_path = state_path
+        self.position_path = state_path + ".pos" if state_path else None
+        # Clave de los intercambios: la semilla o, sin ella, una al azar que
+        # se guarda con la bolsa para poder rehacerlos al reiniciar
+        self._key = seed if seed is not None else random.getrandbits(64)
+        self._changed = False
+        self.round = 0
+        self._bag = []
+        self._cursor = 0
+        self._recent = deque()
+        self._recent_counts = Counter()
+        self._rng = random.Random()
+        self._lock = threading.Lock()
+        if state_path:
+            self._load()
+
+    def __len__(self):
+        return len(self.weights)
+
+    def _round_rng(self):
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}:{self.round}")
+
+    def _refill(self):
+        """Nueva ronda: los elementos repetidos según su peso, barajados"""
+        self.round += 1
+        self._rng = self._round_rng()
+        self._bag = [item for item in sorted(self.weights, key=str) for _ in range(self.weights[item])]
+        self._rng.shuffle(self._bag)
+        self._cursor = 0
+        self._changed = True
+
+    def _valid(self, item, window):
+        return item in self.weights and (window == 0 or self._recent_counts[item] == 0)
+
+    def _remember(self, item, window):
+        self._recent.append(item)
+        self._recent_counts[item] += 1
+        while len(self._recent) > window:
+            self._recent_counts[self._recent.popleft()] -= 1
+
+    def draw(self):
+        """Saca el siguiente elemento, o None si la bolsa no tiene ninguno"""
+        with self._lock:
+            if not self.weights:
+                return None
+            item = self._next()
+            self._save()
+        return item
+
+    def _next(self):
+        """Saca el siguiente elemento sin guardar nada (también al rehacer extracciones)"""
+        # La ventana nunca puede dejar la bolsa sin nada que sacar
+        window = min(self.no_repeat, len(self.weights) - 1)
+        while True:
+            if self._cursor >= len(self._bag):
+                self._refill()
+            item = self._bag[self._cursor]
+            if item not in self.weights:
+                # Retirado después de barajar
+                self._cursor += 1
+                continue
+            if not self._valid(item, window) and not self._swap_for_fresh(window):
+                # Lo que queda de la ronda ha salido hace poco: pasa a la siguiente,
+                # hasta el doble de su peso como mucho (un peso que no cabe en la
+                # ventana no puede hacer crecer la bolsa sin límite)
+                leftover = self._bag[self._cursor:]
+                self._refill()
+                counts = Counter(self._bag)
+                for other in leftover:
+                    if other in self.weights and counts[other] < 2 * self.weights[other]:
+                        counts[other] += 1
+                        self._bag.insert(self._rng.randint(0, len(self._bag)), other)
+                continue
+            item = self._bag[self._cursor]
+            self._cursor += 1
+            break
+        self._remember(item, window)
+        return item
+
+    def _swap_for_fresh(self, window):
+        """Trae a la posición actual un elemento de más adelante que no sea reciente
+
+        Primero prueba unas pocas posiciones al azar; solo si fallan recorre
+        el resto de la ronda. Devuelve False si no queda ninguno.
+        """
+        remaining = len(self._bag) - self._cursor - 1
+        if remaining <= 0:
+            return False
+        rng = random.Random(f"{self._key}:{self.round}:{self._cursor}")
+        candidates = [self._cursor + 1 + rng.randrange(remaining) for _ in range(self.SWAP_TRIES)]
+        for other in candidates + list(range(self._cursor + 1, len(self._bag))):
+            if self._valid(self._bag[other], window):
+                self._bag[self._cursor], self._bag[other] = self._bag[other], self._bag[self._cursor]
+                return True
+        return False
+
+    def add(self, item, weight=1):
+        """Añade un elemento; entra en lo que queda de la ronda actual"""
+        with self._lock:
+            self._add(item, weight)
+            self._save()
+
+    def _add(self, item, weight):
+        if weight <= 0:
+            return
+        self.weights[item] = int(weight)
+        for _ in range(int(weight)):
+            self._bag.insert(self._rng.randint(self._cursor, len(self._bag)), item)
+        self._changed = True
+
+    def discard(self, item):
+        """Retira un elemento; sus apariciones pendientes en la bolsa se saltan"""
+        with self._lock:
+            self.weights.pop(item, None)
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            bag, cursor = state["bag"], state["cursor"]
+            round_number, recent = state["round"], state["recent"]
+            key = state.get("key", self._key)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Estado de selección no válido en {self.state_path}, se empieza de cero: {str(e)}")
+            return
+        self._bag = bag
+        self._cursor = min(cursor, len(bag))
+        self.round = round_number
+        self._rng = self._round_rng()
+        if self.seed is None:
+            self._key = key
+        for item in recent:
+            self._remember(item, self.no_repeat)
+        self._replay()
+        # Lo que apareció desde la última vez entra en lo que queda de esta ronda
+        known = set(bag)
+        for item, weight in list(self.weights.items()):
+            if item not in known:
+                self._add(item, weight)
+        if self._changed:
+            self._save()
+
+    def _replay(self):
+        """Rehace las extracciones hechas desde que se guardó la bolsa"""
+        try:
+            with open(self.position_path) as f:
+                round_number, cursor = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Posición de selección no válida en {self.position_path}: {str(e)}")
+            return
+        if round_number != self.round:
+            # Posición de una ronda anterior a la bolsa guardada
+            return
+        while self.weights and self.round == round_number and self._cursor < min(cursor, len(self._bag)):
+            self._next()
+
+    def _save(self):
+        if not self.state_path:
+            return
+        try:
+            if self._changed:
+                # La bolsa ha cambiado: se guarda entera (una vez por ronda)
+                state = {
+                    "round": self.round, "cursor": self._cursor, "bag": self._bag,
+                    "recent": list(self._recent), "key": self._key,
+                }
+                tmp_path = self.state_path + ".tmp"
+                os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+                with open(tmp_path, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+                self._changed = False
+            # Tras cada extracción solo la ronda y la posición (pocos bytes)
+            with open(self.position_path, 'w') as f:
+                json.dump([self.round, self._cursor], f)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el estado de selección en {self.state_path}: {str(e)}")
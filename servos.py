@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger('tuboton')
+
+# === CURVAS DE SUAVIZADO ===
+# Reciben el progreso del tramo (0..1) y devuelven la fracción del recorrido
+
+def linear(t):
+    return t
+
+def ease_in_out(t):
+    """Arranque y frenada suaves (senoidal)"""
+    return 0.5 - math.cos(math.pi * t) / 2
+
+def ease_out(t):
+    """Arranque brusco y frenada suave (cúbica)"""
+    return 1 - (1 - t) ** 3
+
+# === MOTOR DE MOVIMIENTO ===
+
+# target None = desactivar el servo al terminar el tramo; hold = mantener la posición
+Segment = namedtuple('Segment', ['target', 'duration', 'easing', 'hold'])
+
+# Ángulo que se asume si el servo está desactivado
+DEFAULT_START_ANGLE = -90
+
+class ServoMotion:
+    """Planificador de movimientos de servo que no bloquea el bucle principal
+
+    Cada servo tiene su propia pista de tramos que se ejecutan en orden; las
+    pistas de servos distintos avanzan en paralelo. update() se llama en cada
+    vuelta del bucle y coloca cada servo en el ángulo que le toca en ese instante.
+    """
+
+    def __init__(self):
+        self._tracks = {}
+        self._active = {}
+
+    @property
+    def busy(self):
+        """True si queda algún movimiento pendiente"""
+        return bool(self._active) or any(self._tracks.values())
+
+    def _track(self, servo):
+        return self._tracks.setdefault(servo, deque())
+
+    def move(self, servo, target_angle, duration=0.25, easing=ease_in_out):
+        """Añade un movimiento suave hasta target_angle al final de la pista del servo"""
+        self._track(servo).append(Segment(target_angle, duration, easing, False))
+
+    def hold(self, servo, seconds):
+        """Mantiene la posición actual del servo durante unos segundos"""
+        self._track(servo).append(Segment(None, seconds, linear, True))
+
+    def detach(self, servo, settle=0.1):
+        """Desactiva el servo tras dejarle un momento para asentarse"""
+        self._track(servo).append(Segment(None, settle, linear, False))
+
+    def cancel(self, servo=None):
+        """Descarta los movimientos pendientes de un servo (o de todos)"""
+        servos = [servo] if servo is not None else list(self._tracks)
+        for s in servos:
+            self._tracks.pop(s, None)
+            self._active.pop(s, None)
+
+    def update(self, now=None):
+        """Avanza todas las pistas hasta el instante now"""
+        now = time.time() if now is None else now
+        for servo, track in self._tracks.items():
+            # Un tramo que sigue a otro empieza cuando acabó el anterior, sin acumular retraso
+            next_start = now
+            while True:
+                active = self._active.get(servo)
+                if active is None:
+                    if not track:
+                        break
+                    active = self._start_segment(servo, track.popleft(), next_start)
+
+                segment, started_at, start_angle = active
+                elapsed = now - started_at
+                if elapsed < segment.duration:
+                    if segment.target is not None:
+                        progress = segment.easing(elapsed / segment.duration)
+                        self._set_angle(servo, start_angle + (segment.target - start_angle) * progress)
+                    break
+
+                self._finish_segment(servo, segment)
+                del self._active[servo]
+                next_start = started_at + segment.duration
+
+        self._tracks = {servo: track for servo, track in self._tracks.items() if track or servo in self._active}
+
+    def _start_segment(self, servo, segment, started_at):
+        start_angle = servo.angle if servo.angle is not None else DEFAULT_START_ANGLE
+        active = (segment, started_at, start_angle)
+        self._active[servo] = active
+        return active
+
+    def _finish_segment(self, servo, segment):
+        if segment.target is not None:
+            self._set_angle(servo, segment.target)
+        elif not segment.hold:
+            self._set_angle(servo, None)
+
+    def _set_angle(self, servo, angle):
+        try:
+            servo.angle = angle
+        except Exception as e:
+            logger.error(f"Error al mover el servo: {str(e)}")
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import datetime
+import logging
+import uuid
+
+from config import BUTTON_STYLES, DEBUG_MODE, TICKET_RENDER, QR_URL, QR_SIZE, QR_BORDER, QR_NATIVE
+from impresora import Ticket, TicketTemplate, print_raster
+from maquetacion import art_ticket_raster
+from raster import qr_raster
+
+logger = logging.getLogger('tuboton')
+
+# === TICKETS DEL KIOSKO ===
+# Composición de los tickets (artístico, QR y debug) sin nada del kiosko:
+# importar este módulo no abre cachés, ficheros ni hardware, así que las
+# pruebas de carga pueden componer los mismos tickets en cualquier máquina.
+
+def print_debug(printer):
+    """Imprime solo el título en modo debug"""
+    printer.set(align='center')
+    printer.text("*** TU BOTÓN ***\n")
+    printer.text("\n" * 3)
+    return True
+
+def write_art_ticket(printer, estilo_base, estilo_info, slot):
+    """Escribe el ticket artístico (tras el printer.set inicial)
+
+    slot(printer, nombre) escribe las partes que cambian en cada ticket:
+    'imagen', 'id' y 'fecha'. Así el mismo código sirve para imprimir
+    directamente y para grabar la plantilla de cada estilo.
+    """
+    # 2. Encabezado
+    printer.text("*** TU BOTÓN ***\n")
+    printer.text("--------------------\n")
+    printer.text("Instancia Generativa Única\n\n")
+
+    # 3. Imprimir la imagen
+    slot(printer, "imagen")
+
+    # 4. Información del Diseño
+    printer.text("*** DISEÑO ***\n\n")
+
+    printer.set(align='left')
+    slot(printer, "id")
+    printer.text(f"Sistema Base.: {estilo_base}\n")
+
+    printer.text("\n--- Atributos ---\n")
+    printer.text(f"Estética.....: {estilo_info['desc']}\n")
+    printer.text(f"Referencia...: {estilo_info['ref']}\n")
+    printer.text(f"Estilo.......: {estilo_info['style_text']}\n")
+    printer.text(f"Mediación....: Maquínica\n")
+    printer.text(f"Materialidad.: Tinta/Papel APLI 13323\n\n")
+
+    # 5. Sección Reflexión
+    printer.text("*** ANÁLISIS ***\n\n")
+    printer.text("Necesidad...: No detectada\n")
+    printer.text("Exceso.....: Confirmado\n")
+    printer.text("Proceso....: Algorítmico\n")
+    printer.text("Resultado...: No estándar\n\n")
+
+    # 6. Prompt del estilo
+    printer.set(align='center')
+    printer.text("*** PROMPT ***\n\n")
+    printer.text(f"{estilo_info['prompt']}\n\n")
+
+    # 7. Pie de página
+    printer.text("--------------------\n")
+    printer.text("Fin de Transmisión\n")
+
+    # Fecha y hora
+    slot(printer, "fecha")
+
+    # 8. Código QR al final
+    printer.text("\n")
+    printer.text("*** ACCESO ***\n\n")
+
+    if not print_qr_code(printer):
+        printer.text("[Error al generar QR]\n")
+
+    # Avance de papel
+    printer.text("\n" * 3)
+
+# Plantillas ya compuestas del ticket artístico, por estilo
+art_templates = {}
+
+def art_ticket_template(estilo_base):
+    """Plantilla del ticket para un estilo de BUTTON_STYLES (se compone la primera vez)"""
+    if estilo_base not in BUTTON_STYLES:
+        return None
+    if estilo_base not in art_templates:
+        template = TicketTemplate()
+        write_art_ticket(template, estilo_base, BUTTON_STYLES[estilo_base], lambda p, slot: p.slot(slot))
+        art_templates[estilo_base] = template
+    # None si la plantilla no pasó la comprobación de compile_art_templates
+    return art_templates[estilo_base]
+
+def compile_art_templates():
+    """Compone la plantilla de cada estilo y comprueba que da los mismos bytes que el ticket directo"""
+    def sample(slot_printer, slot):
+        slot_printer.text(f"<{slot}>\n")
+
+    for estilo_base, estilo_info in BUTTON_STYLES.items():
+        template = art_ticket_template(estilo_base)
+        rendered, direct = Ticket(), Ticket()
+        template.render(rendered, sample)
+        write_art_ticket(direct, estilo_base, estilo_info, sample)
+        if rendered.output != direct.output:
+            logger.warning(f"La plantilla del estilo {estilo_base} no coincide con el ticket directo - se compone entero")
+            art_templates[estilo_base] = None
+    logger.info(f"✓ {len(BUTTON_STYLES)} plantillas de ticket compuestas")
+
+# === FUNCIONES PARA QR ===
+
+def print_qr_code(printer):
+    """Añade el código QR al ticket"""
+    try:
+        printer.set(align='center')
+        if QR_NATIVE:
+            # La impresora genera el QR con GS ( k, sin enviar ningún raster
+            printer.qr(QR_URL, size=QR_SIZE, native=True)
+        else:
+            # Raster generado una sola vez y reutilizado en cada ticket
+            raster = qr_raster(QR_URL, QR_SIZE, QR_BORDER)
+            print_raster(printer, raster)
+        printer.text("\n")
+        # Sin mensaje de éxito: esto solo compone (también al grabar las
+        # plantillas); la cola de impresión informa de cada ticket enviado
+        return True
+
+    except Exception as e:
+        logger.error(f"Error al componer el código QR: {str(e)}")
+        return False
+
+def print_qr_ticket(printer):
+    """Imprime un ticket que contiene solo el código QR con título"""
+    try:
+        print("\n--- Iniciando impresión del ticket QR ---")
+
+        # 1. Resetear y configurar inicio
+        printer.set(align='center')
+
+        # 2. Encabezado simple
+        printer.text("*** TU BOTÓN ***\n")
+        printer.text("--------------------\n")
+        printer.text("Código de Acceso\n\n")
+        printer.text("Con tu plan plus de suscripción\n\n")
+
+        # 3. Imprimir el código QR
+        if not print_qr_code(printer):
+            printer.text("[Error al generar QR]\n\n")
+
+        # 4. Pie de página
+        printer.text("--------------------\n")
+        printer.text("Escanea para ver tu botón\n")
+
+        # Fecha y hora
+        now = datetime.datetime.now()
+        fecha_hora = now.strftime("%Y-%m-%d %H:%M:%S")
+        printer.text(f"{fecha_hora}\n")
+
+        # Avance de papel
+        printer.text("\n" * 3)
+
+        print("--- Impresión del ticket QR finalizada ---")
+        return True
+
+    except Exception as e:
+        print(f"Error durante la impresión del ticket QR: {str(e)}")
+        return False
+
+# === TICKET ARTÍSTICO ===
+
+class TicketPrinter:
+    """Tickets que dependen del kiosko: la imagen del botón y el estilo
+
+    raster_cache da el raster de cada imagen (RasterCache); choose_style()
+    devuelve (nombre, info) de BUTTON_STYLES y choose_image() la ruta de una
+    imagen (o None). handlers() da los trabajos para la PrintQueue.
+    """
+
+    def __init__(self, raster_cache, choose_style, choose_image, render=TICKET_RENDER, debug=DEBUG_MODE):
+        self.raster_cache = raster_cache
+        self.choose_style = choose_style
+        self.choose_image = choose_image
+        self.render = render
+        self.debug = debug
+
+    def handlers(self):
+        """Trabajos que puede atender el hilo de impresión"""
+        return {
+            "debug": print_debug,
+            "art": self.print_art_ticket,
+            "qr": print_qr_ticket,
+        }
+
+    def print_image(self, printer, image_path):
+        """Procesa e imprime una imagen en la impresora térmica."""
+        try:
+            print(f"Procesando imagen: {image_path}")
+            # Raster precalculado (de memoria, de disco o procesado ahora)
+            raster = self.raster_cache.get(image_path)
+
+            # Imprimir la imagen
+            printer.set(align='center')
+            print_raster(printer, raster)
+            printer.text("\n")
+            print("Imagen procesada e impresa con éxito")
+            return True
+
+        except FileNotFoundError:
+            print(f"Error: No se encontró el archivo de imagen en '{image_path}'")
+            return False
+        except Exception as e:
+            print(f"Error detallado al procesar/imprimir la imagen: {str(e)}")
+            return False
+
+    def print_ticket_image(self, printer, imagen_generada):
+        """Imagen del botón en el ticket, o un recuadro en su lugar si no se puede imprimir"""
+        if imagen_generada and self.print_image(printer, imagen_generada):
+            return
+        printer.set(align='center')
+        printer.text("[------------------------]\n")
+        printer.text("[     (Aquí iría la      ]\n")
+        printer.text("[   imagen del botón     ]\n")
+        printer.text("[    generado, ~50mm)    ]\n")
+        printer.text("[------------------------]\n\n")
+
+    def print_art_ticket(self, printer, estilo_base=None, imagen_path=None):
+        """Imprime el ticket completo con el diseño artístico."""
+        try:
+            print("\n--- Iniciando impresión del ticket artístico ---")
+
+            # 1. Resetear y configurar inicio
+            printer.set(align='center')
+
+            # En modo debug solo imprimimos el título
+            if self.debug:
+                printer.text("*** TU BOTÓN ***\n")
+                printer.text("\n" * 3)  # Avance de papel
+                return True
+
+            # Seleccionar estilo aleatorio si no se especifica uno
+            if estilo_base is None:
+                estilo_base, estilo_info = self.choose_style()
+            else:
+                estilo_info = BUTTON_STYLES.get(estilo_base, {
+                    "desc": "undefined style",
+                    "ref": "mixed reference",
+                    "style_text": "custom style",
+                    "prompt": "Use undefined style with custom parameters"
+                })
+
+            # Ticket entero maquetado como una sola imagen
+            if self.render == "bitmap":
+                return self.print_art_ticket_bitmap(printer, estilo_base, estilo_info, imagen_path)
+
+            # Lo que cambia en cada ticket
+            imagen_generada = imagen_path if imagen_path else self.choose_image()
+            id_instancia = str(uuid.uuid4())[:8]  # UUID corto para la instancia
+            fecha_hora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            def fill(slot_printer, slot):
+                if slot == "imagen":
+                    self.print_ticket_image(slot_printer, imagen_generada)
+                elif slot == "id":
+                    slot_printer.text(f"ID_Instancia.: {id_instancia}\n")
+                elif slot == "fecha":
+                    slot_printer.text(f"{fecha_hora}\n")
+
+            # Con plantilla del estilo solo se escriben las partes que cambian
+            template = art_ticket_template(estilo_base)
+            if template is not None:
+                template.render(printer, fill)
+            else:
+                write_art_ticket(printer, estilo_base, estilo_info, fill)
+
+            print("--- Impresión del ticket finalizada ---")
+            return True
+
+        except Exception as e:
+            print(f"Error durante la impresión del ticket: {str(e)}")
+            return False
+
+    def print_art_ticket_bitmap(self, printer, estilo_base, estilo_info, imagen_path=None):
+        """Imprime el ticket artístico como un único raster (TICKET_RENDER = "bitmap")"""
+        imagen_generada = imagen_path if imagen_path else self.choose_image()
+        image = None
+        if imagen_generada:
+            try:
+                image = self.raster_cache.get(imagen_generada)
+            except Exception as e:
+                print(f"Error detallado al procesar la imagen '{imagen_generada}': {str(e)}")
+
+        id_instancia = str(uuid.uuid4())[:8]
+        fecha_hora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ticket = art_ticket_raster(
+            estilo_base, estilo_info, id_instancia, fecha_hora,
+            image_raster=image, qr=qr_raster(QR_URL, QR_SIZE, QR_BORDER),
+        )
+        print_raster(printer, ticket)
+        printer.text("\n" * 3)  # Avance de papel
+
+        print("--- Impresión del ticket finalizada ---")
+        return True
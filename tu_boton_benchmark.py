@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+
+# Micro-benchmarks de Tu Botón. No necesita impresora, servos ni pantalla.
+#
+#   python3 tu_boton_benchmark.py raster
+#   python3 tu_boton_benchmark.py reconexion
+#   python3 tu_boton_benchmark.py flujo
+#   python3 tu_boton_benchmark.py bandas
+#   python3 tu_boton_benchmark.py impl [--impresora]
+#   python3 tu_boton_benchmark.py ticket
+#   python3 tu_boton_benchmark.py carga [--rate 300] [--csv carga.csv]
+
+import argparse
+import contextlib
+import csv
+import datetime
+import glob
+import io
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+from PIL import Image, ImageEnhance, ImageOps
+
+from escpos.constants import RT_STATUS_ONLINE
+
+from captura import CaptureBus
+from estados import STATE_TIMEOUTS, TRANSITIONS, SessionMachine
+from config import VENDOR_ID, PRODUCT_ID, BUTTON_STYLES, NO_REPEAT_STYLES, QR_URL, QR_SIZE, QR_BORDER, PRINTER_MAX_WIDTH, THERMAL_CONTRAST, THERMAL_BRIGHTNESS, THERMAL_THRESHOLD
+from impresora import (
+    IMAGE_IMPLS, PrintPacer, PrinterSupervisor, PrintQueue, Ticket, print_raster, printer_key, query_status,
+    save_printer_profile, write_bulk, write_paced,
+)
+from raster import DITHER_MODES, Raster, RasterCache, encode_bands, encode_raster, qr_raster, thermal_raster
+from seleccion import ShuffleBag
+
+def legacy_thermal_raster(image_path):
+    """Cadena PIL original de print_image, como referencia"""
+    img = Image.open(image_path)
+    img = img.convert('L')
+    width, height = img.size
+    if width > PRINTER_MAX_WIDTH:
+        ratio = PRINTER_MAX_WIDTH / width
+        img = img.resize((PRINTER_MAX_WIDTH, int(height * ratio)), Image.Resampling.LANCZOS)
+    img = ImageEnhance.Contrast(img).enhance(THERMAL_CONTRAST)
+    img = ImageEnhance.Brightness(img).enhance(THERMAL_BRIGHTNESS)
+    img = img.point(lambda x: 0 if x < THERMAL_THRESHOLD else 255, '1')
+    img = ImageOps.invert(img)
+    # python-escpos vuelve a invertir: los puntos impresos son los negros
+    return Raster.from_image(ImageOps.invert(img.convert('L')).convert('1'))
+
+def timed(func, paths, repeat):
+    """Ejecuta func sobre todas las rutas y devuelve (segundos por imagen, resultados)"""
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            results[path] = func(path)
+    elapsed = time.perf_counter() - start
+    return elapsed / (repeat * len(paths)), results
+
+def bench_raster(args):
+    """Compara la cadena PIL original con el pipeline fusionado"""
+    paths = sorted(glob.glob(os.path.join("images", "imagen_*.png")))[:args.limit]
+    print(f"Corpus: {len(paths)} imágenes, {args.repeat} repeticiones")
+
+    legacy_time, legacy = timed(legacy_thermal_raster, paths, args.repeat)
+    print(f"{'PIL original':<18} {legacy_time * 1000:8.2f} ms/imagen")
+
+    for mode in DITHER_MODES:
+        mode_time, rasters = timed(lambda path: thermal_raster(path, dither=mode), paths, args.repeat)
+        line = f"{mode:<18} {mode_time * 1000:8.2f} ms/imagen  x{legacy_time / mode_time:.2f}"
+        if mode == "threshold":
+            mismatches = sum(1 for path in paths if rasters[path] != legacy[path])
+            line += f"  ({mismatches} rasters distintos del original)"
+        print(line)
+
+def bench_bands(args):
+    """Codificación de una imagen muy alta de una vez o por bandas: primer byte y memoria máxima"""
+    paths = sorted(glob.glob(os.path.join("images", "imagen_*.png")))[:args.limit]
+    rasters = [thermal_raster(path) for path in paths]
+    width = rasters[0].width
+    tall = Raster(width, sum(r.height for r in rasters if r.width == width),
+                  b"".join(r.rows for r in rasters if r.width == width))
+    print(f"Imagen de {tall.width}x{tall.height} puntos ({len(tall.rows)} bytes empaquetados)")
+
+    def whole(impl):
+        yield encode_raster(tall, impl)
+
+    def banded(impl):
+        return encode_bands(tall, impl, args.band_height)
+
+    for impl in ("bitImageColumn", "bitImageRaster"):
+        for name, encode in (("de una vez", whole), ("por bandas", banded)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            first = None
+            total = 0
+            for band in encode(impl):
+                if first is None:
+                    first = time.perf_counter() - start
+                total += len(band)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{impl:<15} {name:<11} primer byte {first * 1000:8.2f} ms, total {elapsed * 1000:8.2f} ms, "
+                  f"memoria máx {peak / 1024:8.1f} KB ({total} bytes)")
+
+# === IMPRESORA USB SIMULADA ===
+
+def synthetic_ticket(printer, size):
+    """Ticket de relleno del tamaño indicado"""
+    printer._raw(bytes(size))
+    return True
+
+def unplug_storm(bus, rng, mean_interval, down_time, stop):
+    """Desenchufa la impresora a intervalos aleatorios hasta que se pida parar"""
+    while not stop.wait(rng.expovariate(1 / mean_interval)):
+        bus.unplug()
+        if stop.wait(down_time):
+            break
+        bus.plug()
+    bus.plug()
+
+def bench_reconnect(args):
+    """Rendimiento de la cola de impresión con desconexiones frecuentes"""
+    if not args.verbose:
+        logging.getLogger('tuboton').setLevel(logging.CRITICAL)
+    bytes_per_second = args.kbps * 1000
+    ideal = args.jobs * args.size / bytes_per_second
+    print(f"{args.jobs} tickets de {args.size} bytes a {args.kbps} kB/s (sin cortes: {ideal:.2f}s), "
+          f"corte cada ~{args.every}s durante {args.down}s")
+
+    for policy in ("replay", "discard"):
+        bus = CaptureBus(bytes_per_second)
+        supervisor = PrinterSupervisor(bus.connect, reconnect_min=args.backoff_min, reconnect_max=args.backoff_max, print_rate=None)
+        print_queue = PrintQueue(supervisor, {"sintetico": synthetic_ticket}, policy=policy)
+        stop = threading.Event()
+        storm = threading.Thread(target=unplug_storm, args=(bus, random.Random(args.seed), args.every, args.down, stop))
+
+        start = time.perf_counter()
+        storm.start()
+        for _ in range(args.jobs):
+            print_queue.submit("sintetico", size=args.size)
+        print_queue.stop(timeout=None)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        storm.join()
+
+        done_bytes = print_queue.jobs_done * args.size
+        print(
+            f"{policy:<8} {elapsed:6.2f}s  {print_queue.jobs_done} ok / {print_queue.jobs_failed} perdidos, "
+            f"{print_queue.jobs_replayed} reenvíos, {supervisor.disconnects} desconexiones, "
+            f"{supervisor.connects} conexiones - útil {done_bytes / elapsed / 1000:.1f} kB/s, "
+            f"enviado {bus.bytes_written / elapsed / 1000:.1f} kB/s"
+        )
+
+def bench_flow(args):
+    """Envío a ciegas, con la pausa fija de antes, solo con DLE EOT y al ritmo de impresión"""
+    logging.getLogger('tuboton').setLevel(logging.CRITICAL)
+    ticket = bytes(args.size)
+    chunk_size = 64 * 64
+    print(f"{args.tickets} tickets de {args.size} bytes, USB {args.usb_kbps} kB/s, "
+          f"impresión {args.print_kbps} kB/s, buffer {args.buffer} bytes")
+
+    def blind(bus):
+        printer = bus.connect()
+        for _ in range(args.tickets):
+            write_bulk(printer, [ticket], chunk_size)
+
+    def fixed_pause(bus):
+        printer = bus.connect()
+        for _ in range(args.tickets):
+            write_bulk(printer, [ticket], chunk_size)
+            time.sleep(args.pause)
+
+    def status_only(bus):
+        # DLE EOT se contesta al momento: no frena nada si la impresora está lista
+        supervisor = PrinterSupervisor(bus.connect, print_rate=None)
+        supervisor.try_connect()
+        for _ in range(args.tickets):
+            supervisor.write([ticket])
+
+    def paced(bus):
+        supervisor = PrinterSupervisor(bus.connect, print_rate=args.print_kbps * 1000, buffer_size=args.buffer)
+        supervisor.try_connect()
+        for _ in range(args.tickets):
+            supervisor.write([ticket])
+
+    modes = (("a ciegas", blind), (f"pausa {args.pause}s", fixed_pause), ("solo DLE EOT", status_only), ("ritmo", paced))
+    for name, send in modes:
+        bus = CaptureBus(args.usb_kbps * 1000, print_rate=args.print_kbps * 1000, buffer_size=args.buffer)
+        start = time.perf_counter()
+        send(bus)
+        # El último ticket termina cuando la impresora vacía su buffer
+        elapsed = time.perf_counter() - start + bus.drain_time()
+        print(f"{name:<13} {elapsed:6.2f}s  {args.tickets / elapsed * 60:6.1f} tickets/min, "
+              f"{int(bus.overflow)} bytes perdidos por desbordamiento")
+
+def bench_impl(args):
+    """Mide cada comando de imagen ESC/POS y guarda el más rápido para esta impresora
+
+    Con --impresora se imprime de verdad y el tiempo llega hasta que la
+    impresora confirma por DLE EOT que ha terminado (si lo soporta). Sin
+    ella se envía a la impresora simulada y solo cuentan codificación y
+    transferencia, así que el resultado no se guarda salvo con --save.
+    """
+    logging.getLogger('tuboton').setLevel(logging.WARNING)
+    image_path = args.image or sorted(glob.glob(os.path.join("images", "imagen_*.png")))[0]
+    raster = thermal_raster(image_path)
+    print(f"Imagen {image_path} ({raster.width}x{raster.height})")
+
+    if args.impresora:
+        from hardware import setup_printer
+        supervisor = PrinterSupervisor(setup_printer)
+        if not supervisor.try_connect():
+            print("No se pudo conectar con la impresora")
+            return
+        if not supervisor.pacer.rate:
+            print("Aviso: sin PRINTER_PRINT_RATE el tiempo solo incluye la transferencia")
+    else:
+        supervisor = PrinterSupervisor(CaptureBus(args.usb_kbps * 1000).connect)
+        supervisor.try_connect()
+
+    results = {}
+    for impl in IMAGE_IMPLS:
+        encode_time = timed(lambda path: b"".join(encode_bands(raster, impl, args.band_height)), [impl], args.repeat)[0]
+
+        ticket = Ticket()
+        ticket.set(align='center')
+        ticket.text(f"{impl}\n")
+        print_raster(ticket, raster, impl, args.band_height)
+        ticket.text("\n" * 3)
+
+        # En la impresora real cada pasada gasta papel: una sola
+        elapsed = None
+        for _ in range(1 if args.impresora else args.repeat):
+            start = time.perf_counter()
+            sent = supervisor.write(ticket.parts())
+            supervisor.wait_until_printed()
+            run_time = time.perf_counter() - start
+            elapsed = run_time if elapsed is None else min(elapsed, run_time)
+        results[impl] = {"bytes": sent, "codificacion_ms": round(encode_time * 1000, 3), "segundos": round(elapsed, 4)}
+        print(f"{impl:<15} {sent:8d} bytes  codificación {encode_time * 1000:7.2f} ms  total {elapsed:7.3f}s")
+
+    # A igualdad de tiempo (al milisegundo) gana el que envía menos bytes
+    best = min(results, key=lambda impl: (round(results[impl]["segundos"], 3), results[impl]["bytes"]))
+    print(f"Más rápido: {best}")
+    if args.impresora or args.save:
+        save_printer_profile(VENDOR_ID, PRODUCT_ID, {
+            "impl": best,
+            "modo": "impresora" if args.impresora else "simulado",
+            "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+            "imagen": image_path,
+            "resultados": results,
+        })
+        print(f"Guardado para la impresora {printer_key(VENDOR_ID, PRODUCT_ID)}")
+    supervisor.close()
+
+def bench_ticket(args):
+    """Composición del ticket artístico: entero cada vez frente a plantillas por estilo"""
+    import maquetacion
+    import tickets
+    logging.getLogger('tuboton').setLevel(logging.WARNING)
+
+    styles = list(BUTTON_STYLES.items())
+    image_path = args.image or sorted(glob.glob(os.path.join("images", "imagen_*.png")))[0]
+    # Caché solo en memoria: la prueba no toca las cachés del kiosko
+    ticket_printer = tickets.TicketPrinter(RasterCache(), None, None)
+    image = ticket_printer.raster_cache.get(image_path)
+    qr = qr_raster(QR_URL, QR_SIZE, QR_BORDER)
+    print(f"{args.tickets} tickets rotando entre {len(styles)} estilos")
+
+    def fill(slot_printer, slot):
+        if slot == "imagen":
+            ticket_printer.print_ticket_image(slot_printer, image_path)
+        else:
+            slot_printer.text(f"{slot}-0123\n")
+
+    def text_direct(i):
+        estilo_base, estilo_info = styles[i % len(styles)]
+        ticket = Ticket()
+        tickets.write_art_ticket(ticket, estilo_base, estilo_info, fill)
+        return ticket
+
+    def text_template(i):
+        ticket = Ticket()
+        tickets.art_ticket_template(styles[i % len(styles)][0]).render(ticket, fill)
+        return ticket
+
+    def bitmap(i):
+        estilo_base, estilo_info = styles[i % len(styles)]
+        return maquetacion.art_ticket_raster(estilo_base, estilo_info, "0123abcd", "2026-01-01 00:00:00", image, qr)
+
+    def bitmap_uncached(i):
+        for cached in (maquetacion.static_section, maquetacion.style_section, maquetacion.qr_section):
+            cached.cache_clear()
+        return bitmap(i)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        tickets.compile_art_templates()
+        maquetacion.prerender_static()
+        runs = {}
+        for name, compose in (("texto, entero", text_direct), ("texto, plantilla", text_template),
+                              ("bitmap, entero", bitmap_uncached), ("bitmap, caché", bitmap)):
+            start = time.perf_counter()
+            runs[name] = [compose(i) for i in range(args.tickets)]
+            runs[name + " tiempo"] = (time.perf_counter() - start) / args.tickets
+
+    same = all(a.output == b.output for a, b in zip(runs["texto, entero"], runs["texto, plantilla"]))
+    for before, after in (("texto, entero", "texto, plantilla"), ("bitmap, entero", "bitmap, caché")):
+        before_time, after_time = runs[before + " tiempo"], runs[after + " tiempo"]
+        print(f"{before:<17} {before_time * 1000:8.3f} ms/ticket")
+        print(f"{after:<17} {after_time * 1000:8.3f} ms/ticket  x{before_time / after_time:.1f}")
+    print(f"Tickets de texto idénticos con y sin plantilla: {'sí' if same else 'NO'}")
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+def bench_load(args):
+    """Prueba de carga: tickets artísticos reales por la cola hacia la impresora simulada"""
+    import maquetacion
+    import tickets
+    logging.getLogger('tuboton').setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+
+    # Estilos reproducibles y sin tocar la posición guardada del kiosko
+    styles = ShuffleBag(dict.fromkeys(BUTTON_STYLES, 1), NO_REPEAT_STYLES, args.seed)
+
+    def choose_style():
+        name = styles.draw()
+        return name, BUTTON_STYLES[name]
+
+    images = sorted(glob.glob(os.path.join("images", "imagen_*.png")))
+    # Rasters en memoria antes de empezar, como tras la precarga del kiosko
+    raster_cache = RasterCache()
+    for image_path in images:
+        raster_cache.get(image_path)
+    ticket_printer = tickets.TicketPrinter(raster_cache, choose_style, lambda: None, render=args.render)
+    print_rate = args.print_kbps * 1000 if args.print_kbps else None
+    bus = CaptureBus(args.usb_kbps * 1000, latency=args.latency, print_rate=print_rate, sink=args.captura)
+    supervisor = PrinterSupervisor(bus.connect, print_rate=print_rate)
+    supervisor.try_connect()
+    print(f"{args.tickets} tickets '{args.render}' a {args.rate:g}/min, USB simulado a {args.usb_kbps:g} kB/s "
+          f"y {args.latency * 1000:g} ms por transferencia")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.render == "bitmap":
+            maquetacion.prerender_static()
+        else:
+            tickets.compile_art_templates()
+        print_queue = PrintQueue(supervisor, ticket_printer.handlers(), keep_stats=args.tickets)
+        interval = 60 / args.rate
+        start = time.time()
+        for i in range(args.tickets):
+            delay = start + i * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            print_queue.submit("art", imagen_path=images[i % len(images)] if images else None)
+        print_queue.stop(timeout=None)
+    elapsed = time.time() - start
+    bus.close()
+
+    stats = list(print_queue.stats)
+    sizes = [s.bytes for s in stats]
+    print(f"{print_queue.jobs_done} ok / {print_queue.jobs_failed} fallidos en {elapsed:.1f}s "
+          f"({len(stats) / elapsed * 60:.0f} tickets/min)")
+    print(f"Bytes por ticket: media {sum(sizes) / len(sizes):.0f}, mín {min(sizes)}, máx {max(sizes)}; "
+          f"capturados {bus.bytes_written} en {bus.transfers} transferencias")
+    for name, values in (("composición", [s.compose for s in stats]), ("envío", [s.send for s in stats]),
+                         ("espera en cola", [s.wait for s in stats])):
+        print(f"{name:<15} p50 {percentile(values, 0.5) * 1000:8.1f} ms  p95 {percentile(values, 0.95) * 1000:8.1f} ms  "
+              f"máx {max(values) * 1000:8.1f} ms")
+
+    # Evolución en el tiempo, por ventanas según cuándo terminó cada trabajo
+    print(f"{'ventana':>9} {'tickets':>8} {'bytes/ticket':>13} {'comp. p95':>10} {'espera máx':>11}")
+    windows = {}
+    for s in stats:
+        windows.setdefault(int((s.finished_at - start) // args.window), []).append(s)
+    for index, window in sorted(windows.items()):
+        print(f"{index * args.window:>8g}s {len(window):>8} {sum(s.bytes for s in window) / len(window):>13.0f} "
+              f"{percentile([s.compose for s in window], 0.95) * 1000:>8.1f}ms {max(s.wait for s in window):>10.2f}s")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["job_id", "ok", "bytes", "espera_s", "composicion_s", "envio_s", "terminado_s"])
+            for s in stats:
+                writer.writerow([s.job_id, int(s.ok), s.bytes, f"{s.wait:.4f}", f"{s.compose:.4f}",
+                                 f"{s.send:.4f}", f"{s.finished_at - start:.3f}"])
+        print(f"Medidas por ticket en {args.csv}")
+    if args.captura:
+        print(f"Bytes ESC/POS en {args.captura}")
+
+# Comienzo de los comandos de imagen ESC/POS
+IMAGE_COMMANDS = (b"\x1b*", b"\x1dv0", b"\x1d(L")
+
+def bench_status(args):
+    """Comprueba que las consultas DLE EOT nunca caen dentro de un comando de imagen"""
+    logging.getLogger('tuboton').setLevel(logging.CRITICAL)
+    image_path = args.image or sorted(glob.glob(os.path.join("images", "imagen_*.png")))[0]
+    raster = thermal_raster(image_path)
+    problems = []
+    for impl in IMAGE_IMPLS:
+        for band_height in (None, 24, 64):
+            ticket = Ticket()
+            ticket.text("Cabecera\n")
+            print_raster(ticket, raster, impl, band_height)
+            ticket.text("Pie\n" * 3)
+
+            # Tramos [inicio, fin) de cada comando de imagen en el ticket
+            images = []
+            position = 0
+            for part in ticket.parts():
+                if part.startswith(IMAGE_COMMANDS):
+                    images.append((position, position + len(part)))
+                position += len(part)
+
+            bus = CaptureBus()
+            printer = bus.connect()
+            queries = []
+
+            def wait_ready():
+                # Posición en el ticket (sin contar las consultas anteriores)
+                queries.append(bus.bytes_written - len(RT_STATUS_ONLINE) * len(queries))
+                query_status(printer, RT_STATUS_ONLINE, 0.1)
+
+            write_paced(printer, ticket.parts(), args.chunk, PrintPacer(None), time.sleep, wait_ready, args.window)
+
+            inside = [at for at in queries if any(start < at < end for start, end in images)]
+            # Sin las consultas, lo capturado es exactamente el ticket
+            stream = bytes(bus.captured)
+            for number, at in reversed(list(enumerate(queries))):
+                offset = at + len(RT_STATUS_ONLINE) * number
+                if stream[offset:offset + len(RT_STATUS_ONLINE)] != RT_STATUS_ONLINE:
+                    inside.append(at)
+                stream = stream[:offset] + stream[offset + len(RT_STATUS_ONLINE):]
+            label = f"{impl} bandas {band_height or 'no'}"
+            print(f"{label:<30} {len(queries):3d} consultas, {len(images):3d} comandos de imagen")
+            if inside or stream != ticket.output:
+                problems.append(f"{label}: consultas dentro de una imagen en {inside}")
+    if problems:
+        for problem in problems:
+            print(f"FALLO {problem}")
+        raise SystemExit(1)
+    print("OK: DLE EOT solo entre comandos")
+
+def simulate_sessions(presses, timeouts=STATE_TIMEOUTS):
+    """Ejecuta SessionMachine con reloj simulado; presses es una lista de (instante, acción)
+
+    Devuelve las entradas en estado (instante, sesión, estado), el resultado
+    de cada pulsación y la imagen en pantalla tras cada paso.
+    """
+    entered = []
+    shown = []
+    machine = SessionMachine(lambda session, state: entered.append((now[0], session.session_id, state)), timeouts=timeouts)
+    now = [0.0]
+    outcomes = []
+    pending = sorted(presses)
+    while pending or machine.sessions:
+        next_timer = machine.seconds_until_next(now[0])
+        if pending and (next_timer is None or pending[0][0] <= now[0] + next_timer):
+            now[0], action = pending.pop(0)
+            machine.run_due(now[0])
+            outcome = machine.accept_press(now[0])
+            if outcome == "start":
+                machine.start(action, f"imagen_{action}", now=now[0])
+            outcomes.append((now[0], action, outcome))
+        else:
+            now[0] += next_timer
+            machine.run_due(now[0])
+        shown.append((now[0], machine.current_image))
+    return entered, outcomes, shown
+
+def expected_entries(session_id, action, start, timeouts=STATE_TIMEOUTS):
+    """Entradas en estado que la tabla de transiciones prevé para una sesión"""
+    entries = []
+    state, event, at = "neutral", action, start
+    while True:
+        state = TRANSITIONS[(state, event)]
+        entries.append((at, session_id, state))
+        if state == "neutral":
+            return entries
+        at += timeouts[state]
+        event = "timeout"
+
+def bench_sessions(args):
+    """Comprueba que dos sesiones solapadas intercalan sus temporizadores"""
+    # La segunda pulsación llega con la primera ya girando los servos; la
+    # tercera, con la pantalla ocupada por la segunda
+    second_at = STATE_TIMEOUTS["waiting"] + args.offset
+    presses = [(0.0, "ticket_servos"), (second_at, "ticket_qr"), (second_at + 0.1, "solo_imagen")]
+    entered, outcomes, shown = simulate_sessions(presses)
+
+    expected = sorted(expected_entries(1, "ticket_servos", 0.0) + expected_entries(2, "ticket_qr", second_at))
+    problems = []
+    if [outcome for _, _, outcome in outcomes] != ["start", "start", "ignored"]:
+        problems.append(f"pulsaciones: {outcomes}")
+    if [(round(at, 6), sid, state) for at, sid, state in entered] != [(round(at, 6), sid, state) for at, sid, state in expected]:
+        problems.append(f"transiciones: {entered}")
+    # La imagen de la primera sigue visible hasta que la segunda toma la pantalla
+    images = [image for at, image in shown if at >= second_at]
+    if not images or images[0] != "imagen_ticket_qr" or "imagen_ticket_servos" in images:
+        problems.append(f"pantalla: {shown}")
+
+    for at, session_id, state in entered:
+        print(f"+{at:5.2f}s  sesión #{session_id}  {state}")
+    if problems:
+        for problem in problems:
+            print(f"FALLO {problem}")
+        raise SystemExit(1)
+    print("OK: temporizadores intercalados y pantalla cedida al girar los servos")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de Tu Botón")
+    subparsers = parser.add_subparsers(dest="modo", required=True)
+
+    raster_parser = subparsers.add_parser("raster", help="Pipeline de imagen térmica")
+    raster_parser.add_argument("--repeat", type=int, default=3)
+    raster_parser.add_argument("--limit", type=int, default=None, help="Número máximo de imágenes")
+    raster_parser.set_defaults(func=bench_raster)
+
+    reconnect_parser = subparsers.add_parser("reconexion", help="Cola de impresión con la impresora USB simulada desenchufándose")
+    reconnect_parser.add_argument("--jobs", type=int, default=40)
+    reconnect_parser.add_argument("--size", type=int, default=20000, help="Bytes por ticket")
+    reconnect_parser.add_argument("--kbps", type=float, default=200, help="Ancho de banda simulado en kB/s")
+    reconnect_parser.add_argument("--every", type=float, default=0.5, help="Segundos medios entre desconexiones")
+    reconnect_parser.add_argument("--down", type=float, default=0.2, help="Segundos que la impresora pasa desenchufada")
+    reconnect_parser.add_argument("--backoff-min", type=float, default=0.05)
+    reconnect_parser.add_argument("--backoff-max", type=float, default=1.0)
+    reconnect_parser.add_argument("--seed", type=int, default=1)
+    reconnect_parser.add_argument("--verbose", action="store_true", help="Mostrar el log de la cola")
+    reconnect_parser.set_defaults(func=bench_reconnect)
+
+    flow_parser = subparsers.add_parser("flujo", help="Control de flujo hacia el buffer de la impresora simulada")
+    flow_parser.add_argument("--tickets", type=int, default=5)
+    flow_parser.add_argument("--size", type=int, default=20000, help="Bytes por ticket")
+    flow_parser.add_argument("--usb-kbps", type=float, default=1000, help="Ancho de banda USB simulado en kB/s")
+    flow_parser.add_argument("--print-kbps", type=float, default=30, help="Velocidad de impresión en kB/s")
+    flow_parser.add_argument("--buffer", type=int, default=8192, help="Buffer de recepción de la impresora en bytes")
+    flow_parser.add_argument("--pause", type=float, default=2.0, help="Pausa fija tras cada ticket (comportamiento anterior)")
+    flow_parser.set_defaults(func=bench_flow)
+
+    bands_parser = subparsers.add_parser("bandas", help="Codificación de imágenes altas por bandas")
+    bands_parser.add_argument("--limit", type=int, default=40, help="Imágenes apiladas en la imagen alta")
+    bands_parser.add_argument("--band-height", type=int, default=256, help="Líneas por banda con GS v 0")
+    bands_parser.set_defaults(func=bench_bands)
+
+    impl_parser = subparsers.add_parser("impl", help="Comando de imagen ESC/POS más rápido para la impresora")
+    impl_parser.add_argument("--impresora", action="store_true", help="Imprimir de verdad en la impresora USB")
+    impl_parser.add_argument("--image", default=None, help="Imagen de prueba (por defecto la primera de images/)")
+    impl_parser.add_argument("--usb-kbps", type=float, default=1000, help="Ancho de banda de la impresora simulada en kB/s")
+    impl_parser.add_argument("--band-height", type=int, default=256, help="Líneas por banda con GS v 0 / GS ( L")
+    impl_parser.add_argument("--repeat", type=int, default=5)
+    impl_parser.add_argument("--save", action="store_true", help="Guardar también el resultado simulado")
+    impl_parser.set_defaults(func=bench_impl)
+
+    ticket_parser = subparsers.add_parser("ticket", help="Composición del ticket artístico con y sin plantillas")
+    ticket_parser.add_argument("--tickets", type=int, default=120)
+    ticket_parser.add_argument("--image", default=None, help="Imagen del ticket (por defecto la primera de images/)")
+    ticket_parser.set_defaults(func=bench_ticket)
+
+    load_parser = subparsers.add_parser("carga", help="Prueba de carga de la cola de impresión con la impresora simulada")
+    load_parser.add_argument("--tickets", type=int, default=300)
+    load_parser.add_argument("--rate", type=float, default=300, help="Tickets por minuto encolados")
+    load_parser.add_argument("--render", choices=("texto", "bitmap"), default="texto", help="Modo del ticket (TICKET_RENDER)")
+    load_parser.add_argument("--usb-kbps", type=float, default=1000, help="Ancho de banda USB simulado en kB/s")
+    load_parser.add_argument("--print-kbps", type=float, default=None, help="Velocidad de impresión en kB/s (por defecto sin límite)")
+    load_parser.add_argument("--latency", type=float, default=0.001, help="Segundos que añade cada transferencia USB")
+    load_parser.add_argument("--captura", default=None, help="Fichero donde guardar los bytes ESC/POS (por defecto en memoria)")
+    load_parser.add_argument("--csv", default=None, help="Fichero CSV con las medidas de cada ticket")
+    load_parser.add_argument("--window", type=float, default=10, help="Segundos por ventana en la evolución")
+    load_parser.add_argument("--seed", type=int, default=1)
+    load_parser.add_argument("--verbose", action="store_true", help="Mostrar el log de la cola")
+    load_parser.set_defaults(func=bench_load)
+
+    status_parser = subparsers.add_parser("estado", help="Comprueba que DLE EOT no se intercala en las imágenes")
+    status_parser.add_argument("--image", default=None, help="Imagen del ticket (por defecto la primera de images/)")
+    status_parser.add_argument("--chunk", type=int, default=4096, help="Bytes por transferencia USB")
+    status_parser.add_argument("--window", type=int, default=1000, help="Bytes entre consultas de estado")
+    status_parser.set_defaults(func=bench_status)
+
+    sessions_parser = subparsers.add_parser("sesiones", help="Comprueba dos sesiones solapadas con reloj simulado")
+    sessions_parser.add_argument("--offset", type=float, default=0.5, help="Segundos tras empezar a girar los servos en que llega la segunda pulsación")
+    sessions_parser.set_defaults(func=bench_sessions)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()